@@ -0,0 +1,180 @@
+#!/bin/env python
+# Precompiled theme pictures: the icons packed in a single atlas & the page backgrounds,
+# stored as raw pixels in the display format so that the UI loads them without decoding
+# any PNG. Build the cache once (again after changing the theme, stale caches are ignored):
+#   python atlas.py [--theme NAME]
+# Run it like the UI (same SDL video driver) to get the pixel format of the display.
+
+import os
+import sys
+import json
+import mmap
+import glob
+import struct
+import argparse
+
+import pygame
+
+from theme import ASSETS_DIR, load_theme, ThemeError
+
+ASSET_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'pgui4o') # precompiled themes
+ASSET_CACHE_VERSION = 1 # caches of another version are ignored
+ATLAS_WIDTH = 512 # pixels, icons are packed in rows of this width
+ATLAS_PADDING = 1 # pixels between two icons
+
+_MAGIC = b'PGUI4OAT'
+_HEADER = struct.Struct('<8sII') # magic, version, length of the JSON index
+_ALIGN = 64 # pixel data offsets are multiple of this
+
+
+def cache_path(theme, cache_dir=ASSET_CACHE_DIR):
+    return os.path.join(cache_dir, 'theme-%s.raw'%theme.name)
+
+
+def theme_pictures(theme):
+    # (icons, backgrounds) paths used by a theme, theme files overriding the shared assets
+    backgrounds = [theme.background_path(page) for page in range(theme.page_count)]
+    names = set(os.path.basename(p) for d in (ASSETS_DIR, theme.path) for p in glob.glob(os.path.join(d, '*.png')))
+    icons = sorted(theme.resource_path(name) for name in names)
+    return [p for p in icons if p not in backgrounds], backgrounds
+
+
+def sources(paths):
+    # the cache is bound to the size & date of every picture
+    return dict((p, [os.path.getsize(p), os.path.getmtime(p)]) for p in paths)
+
+
+def pack(sizes, width=ATLAS_WIDTH, padding=ATLAS_PADDING):
+    # Shelf packing, tallest first: ({index: (x, y)}, atlas height)
+    positions = {}
+    x = y = shelf = 0
+    for i in sorted(range(len(sizes)), key=lambda i: -sizes[i][1]):
+        w, h = sizes[i]
+        if x and x + w > width:
+            x, y, shelf = 0, y + shelf + padding, 0
+        positions[i] = (x, y)
+        x += w + padding
+        shelf = max(shelf, h)
+    return positions, y + shelf
+
+
+def display_format():
+    surface = pygame.display.get_surface()
+    return [surface.get_bitsize(), list(surface.get_masks())]
+
+
+def _entry(surface, offset):
+    return {'size': list(surface.get_size()), 'bitsize': surface.get_bitsize(), 'masks': list(surface.get_masks()),
+            'pitch': surface.get_pitch(), 'offset': offset}
+
+
+def build_cache(theme, path=None):
+    # Writes the cache of a theme, the display mode must be set
+    path = path or cache_path(theme)
+    icons, backgrounds = theme_pictures(theme)
+    pictures = [pygame.image.load(p).convert_alpha() for p in icons]
+    positions, height = pack([p.get_size() for p in pictures])
+    atlas = pygame.Surface((ATLAS_WIDTH, max(1, height)), pygame.SRCALPHA, 32).convert_alpha()
+    atlas.fill((0, 0, 0, 0))
+    rects = {}
+    for i, picture in enumerate(pictures):
+        atlas.blit(picture, positions[i], special_flags=pygame.BLEND_RGBA_MAX)
+        rects[icons[i]] = list(positions[i]) + list(picture.get_size())
+    surfaces = [('atlas', atlas)] + [(p, pygame.image.load(p).convert()) for p in backgrounds]
+
+    index = {'version': ASSET_CACHE_VERSION, 'sources': sources(icons + backgrounds), 'display': display_format(),
+            'icons': rects, 'surfaces': {}}
+    offset = 0
+    for name, surface in surfaces:
+        index['surfaces'][name] = _entry(surface, offset)
+        offset += (surface.get_pitch()*surface.get_height() + _ALIGN - 1) // _ALIGN * _ALIGN
+    data = json.dumps(index).encode('utf-8')
+    start = (_HEADER.size + len(data) + _ALIGN - 1) // _ALIGN * _ALIGN
+
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path + '.tmp', 'wb') as f:
+        f.write(_HEADER.pack(_MAGIC, ASSET_CACHE_VERSION, len(data)))
+        f.write(data)
+        for name, surface in surfaces:
+            f.seek(start + index['surfaces'][name]['offset'])
+            f.write(surface.get_view('1').raw)
+        f.truncate(start + offset)
+    os.rename(path + '.tmp', path)
+    return path
+
+
+def _surface(data, entry, alpha, convert):
+    # Surface of the stored format filled with the raw pixels
+    w, h = entry['size']
+    surface = pygame.Surface((w, h), pygame.SRCALPHA if alpha else 0, entry['bitsize'], entry['masks'])
+    pixels = memoryview(surface.get_view('1')).cast('B')
+    try:
+        src, pitch, dst = entry['offset'], entry['pitch'], surface.get_pitch()
+        if pitch == dst:
+            pixels[:] = data[src:src + pitch*h]
+        else:
+            line = min(pitch, dst)
+            for y in range(h):
+                pixels[y*dst:y*dst + line] = data[src + y*pitch:src + y*pitch + line]
+    finally:
+        pixels.release()
+    if convert:
+        return surface.convert_alpha() if alpha else surface.convert()
+    return surface
+
+
+def load_cache(theme, path=None):
+    # {(path, alpha): surface} of the precompiled pictures of a theme (icons are parts of
+    # the atlas), None if there is no up to date cache: the PNG files are loaded instead
+    path = path or cache_path(theme)
+    try:
+        with open(path, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (IOError, OSError, ValueError):
+        return None
+    try:
+        magic, version, length = _HEADER.unpack_from(data)
+        if magic != _MAGIC or version != ASSET_CACHE_VERSION:
+            return None
+        index = json.loads(data[_HEADER.size:_HEADER.size + length].decode('utf-8'))
+        icons, backgrounds = theme_pictures(theme)
+        if index['sources'] != sources(icons + backgrounds):
+            print('Theme cache %s is outdated, rebuild it with "python atlas.py --theme %s"'%(path, theme.name))
+            return None
+        convert = index['display'] != display_format() # built for another display: still faster than PNGs
+        start = (_HEADER.size + length + _ALIGN - 1) // _ALIGN * _ALIGN
+        mapped = memoryview(data)
+        view = mapped[start:]
+        try:
+            surfaces = {}
+            entries = index['surfaces']
+            atlas = _surface(view, entries['atlas'], True, convert)
+            for name, rect in index['icons'].items():
+                surfaces[(name, True)] = atlas.subsurface(rect)
+            for name in backgrounds:
+                surfaces[(name, False)] = _surface(view, entries[name], False, convert)
+        finally:
+            view.release()
+            mapped.release()
+        return surfaces
+    except (struct.error, ValueError, KeyError, TypeError) as e:
+        print("Can't load the theme cache %s: %s"%(path, e))
+        return None
+    finally:
+        data.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Precompiles the pictures of a theme')
+    parser.add_argument('--theme', default=os.getenv('THEME', 'default'))
+    args = parser.parse_args()
+    try:
+        theme = load_theme(args.theme)
+    except ThemeError as e:
+        print('ERROR: cannot load theme "%s": %s'%(args.theme, e))
+        sys.exit(-1)
+    pygame.display.init()
+    pygame.display.set_mode((1, 1))
+    print('Wrote %s'%build_cache(theme))
+    pygame.quit()
@@ -0,0 +1,230 @@
+#!/bin/env python
+# Headless benchmarks of the render & input hot paths, for every theme:
+#   python bench.py [--theme NAME] [--json results.json] [--compare previous.json]
+# Runs the App with SDL's dummy video driver and a canned OctoPrint transport (no network).
+
+import os
+import sys
+import gc
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+os.environ.setdefault('OCTOPRINT_API_KEY', 'benchmark')
+os.environ['NOFS'] = '1'
+
+import pygame
+
+import gui
+from theme import load_theme, list_themes
+from perf import clock
+from framebuffer import Framebuffer
+
+BENCH_MIN_TIME = 0.2 # seconds spent per round
+BENCH_ROUNDS = 5 # the median round is reported
+ALLOC_ITERATIONS = 50
+
+PRINTER_STATUS = {
+        'state': {'text': 'Printing', 'flags': {'paused': False, 'printing': True, 'operational': True}},
+        'temperature': {
+            'tool0': {'actual': 214.8, 'target': 215.0, 'offset': 0},
+            'bed': {'actual': 59.9, 'target': 60.0, 'offset': 0},
+            },
+        'sd': {'ready': True},
+        }
+
+FILE_LISTING = {'files': [
+        {'name': 'part%d.gcode'%i, 'path': 'part%d.gcode'%i, 'type': 'machinecode', 'origin': 'local',
+            'size': 100000 + i, 'date': 1600000000 + i, 'prints': {'last': {'date': 1600000000 + i}} if i % 3 == 0 else {}}
+        for i in range(30)]}
+FILE_LISTING_ETAG = '"bench"'
+
+
+class CannedResponse:
+    def __init__(self, data=None, status_code=200, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.text = json.dumps(data) if data is not None else ''
+
+    def json(self):
+        return json.loads(self.text) # parsing is part of the measured work
+
+
+class CannedTransport:
+    # Stands for HttpTransport: answers immediately with fixed OctoPrint replies
+
+    def get(self, url, **kw):
+        if url.endswith('api/files'): # conditional request, as OctoPrint answers it
+            if kw.get('headers', {}).get('If-None-Match') == FILE_LISTING_ETAG:
+                return CannedResponse(None, 304)
+            return CannedResponse(FILE_LISTING, headers={'ETag': FILE_LISTING_ETAG})
+        return CannedResponse(PRINTER_STATUS)
+
+    def post(self, url, **kw):
+        return CannedResponse(None, 204)
+
+    def close(self):
+        pass
+
+
+def measure(fn):
+    # Returns (ops/sec, net allocated blocks per op, peak KB per op) of fn()
+    fn() # warm up
+    rates = []
+    for _ in range(BENCH_ROUNDS):
+        count = 0
+        t0 = clock()
+        while True:
+            fn()
+            count += 1
+            elapsed = clock() - t0
+            if elapsed >= BENCH_MIN_TIME:
+                break
+        rates.append(count / elapsed)
+    rates.sort()
+
+    gc.collect()
+    gc.disable()
+    tracemalloc.start()
+    blocks = sys.getallocatedblocks()
+    for _ in range(ALLOC_ITERATIONS):
+        fn()
+    blocks = sys.getallocatedblocks() - blocks
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    gc.enable()
+    return rates[len(rates)//2], blocks / float(ALLOC_ITERATIONS), peak / 1024.0 / ALLOC_ITERATIONS
+
+
+def make_app(theme_name):
+    app = gui.App(load_theme(theme_name))
+    app.printer.engine = None # run commands inline, on the canned transport
+    app.printer.http = CannedTransport()
+    app.printer.fetch_status()
+    app.update()
+    return app
+
+
+def action_points(app, page):
+    # center of every action of the page
+    return [((r[0]+r[2])//2, (r[1]+r[3])//2) for r in app.actions[page]]
+
+
+def bench_theme(theme_name, results):
+    app = make_app(theme_name)
+
+    def run(name, fn):
+        results['%s/%s'%(theme_name, name)] = measure(fn)
+
+    for page in range(app.page_count):
+        def full(page=page):
+            app._cur_page = page
+            app.invalidate()
+            app.draw_ui()
+
+        def partial(page=page):
+            app._cur_page = page
+            app.printer.fan_speed.value = (app.printer.fan_speed.value + 1) % 255
+            app.printer.baby_offset.value += 0.05
+            app.printer_info = {'extruder': (200 + app.printer.fan_speed.value/10.0, 215), 'bed': (60, 60)}
+            app.draw_ui()
+
+        def idle(page=page):
+            app._cur_page = page
+            app.draw_ui()
+
+        run('draw_ui.full.page%d'%page, full)
+        run('draw_ui.partial.page%d'%page, partial)
+        run('draw_ui.idle.page%d'%page, idle)
+
+    # swipe animation frames, from a page to the next one
+    app._cur_page = min(1, app.page_count-1)
+    size = app.size[1] if app.options.vertical_swipe else app.size[0]
+    offsets = list(range(0, -size, -max(1, size//12)))
+    state = {'i': 0}
+
+    def swipe_frame():
+        app._swipe = dict(start_time=time.time(), start=0, end=-size, page=app._cur_page,
+                offset=offsets[state['i'] % len(offsets)])
+        state['i'] += 1
+        app.draw_ui()
+
+    run('swipe.frame', swipe_frame)
+    app._swipe = None
+
+    def popup():
+        app.add_popup({
+            'actions' : ['pause', 'restart_print', 'cancel_print', ''],
+            'captions' : ['resume', 'restart', 'cancel', 'close popup'],
+            })
+        app.draw_ui()
+        app._popups = []
+        app.set_font()
+
+    run('popup.draw', popup)
+    app.draw_ui()
+
+    # RGB565 conversion & copy of a frame to a (file backed) framebuffer
+    path = os.path.join(tempfile.gettempdir(), 'pgui4o-bench.fb')
+    fb = Framebuffer(path, app.size)
+    run('framebuffer.full', lambda: fb.write(app._screen))
+    run('framebuffer.partial', lambda: fb.write(app._screen, [(0, 0, 40, 20), (200, 150, 60, 30)]))
+    fb.close()
+    os.remove(path)
+
+    for page in range(app.page_count):
+        points = action_points(app, page)
+
+        def dispatch(page=page, points=points):
+            for x, y in points:
+                app._cur_page = page
+                app.run_action_at(x, y)
+                app._popups = []
+            app._running = True
+            pygame.event.clear()
+
+        run('run_action_at.page%d (x%d)'%(page, len(points)), dispatch)
+
+    run('fetch_status', app.printer.fetch_status)
+    pygame.quit()
+
+
+def print_results(results, previous=None):
+    width = max(len(name) for name in results)
+    print('%-*s %14s %10s %10s%s'%(width, 'benchmark', 'ops/sec', 'blocks/op', 'KB/op', '   change' if previous else ''))
+    for name in sorted(results):
+        rate, blocks, peak = results[name]
+        line = '%-*s %14.1f %10.1f %10.2f'%(width, name, rate, blocks, peak)
+        if previous and name in previous:
+            line += ' %+8.1f%%'%((rate / previous[name][0] - 1) * 100)
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='pgui4o benchmarks')
+    parser.add_argument('--theme', action='append', help='theme to run (default: all)')
+    parser.add_argument('--json', help='save the results to this file')
+    parser.add_argument('--compare', help='results file of a previous run')
+    args = parser.parse_args()
+
+    results = {}
+    for theme_name in args.theme or list_themes():
+        bench_theme(theme_name, results)
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    print_results(results, previous)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+#!/bin/env python
+# Local stand-in for an OctoPrint server, to run the UI without a printer:
+#   python fakeprint.py [--port 5000] [--latency 0.2] [--jitter 0.05] [--files 2000]
+#   OCTOPRINT_HOST=127.0.0.1:5000 ./run
+# Serves the REST endpoints used by printer.py and the SockJS push channel (xhr-streaming).
+# --latency/--jitter delay every REST reply, to reproduce slow links (e.g. with TRACE=trace.json).
+# --files fills the library with that many fake G-code files, api/files honors If-None-Match.
+
+import json
+import math
+import time
+import hashlib
+import random
+import argparse
+import threading
+
+from gcode import GCodeState
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import unquote, parse_qs
+except ImportError: # python2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib import unquote
+    from urlparse import parse_qs
+
+PUSH_INTERVAL = 0.5 # seconds between two "current" messages
+
+
+class FakePrinter:
+    # Simulated printer state, heaters slowly converge to their target
+
+    def __init__(self, files=20):
+        self.lock = threading.Lock()
+        self.state = 'Operational'
+        self.flags = dict(paused=False, printing=False, operational=True)
+        self.temps = {'tool0': [21.0, 0], 'bed': [21.0, 0]}
+        self.commands = []
+        self.toolhead = GCodeState() # where the fake toolhead is
+        self.logs = [] # serial lines sent with the next push message
+        now = int(time.time())
+        self.files = [{'name': 'part_%04d.gcode'%i, 'path': 'parts/part_%04d.gcode'%i, 'type': 'machinecode',
+            'origin': 'local', 'size': 100000 + i, 'date': now - i*3600} for i in range(files)]
+
+    def step(self):
+        with self.lock:
+            for t in self.temps.values():
+                goal = t[1] or 21.0
+                t[0] += (goal - t[0]) * 0.1
+
+    def temperature(self):
+        with self.lock:
+            return dict((k, {'actual': round(v[0], 1), 'target': v[1]}) for k, v in self.temps.items())
+
+    def status(self):
+        return {
+                'state': {'text': self.state, 'flags': dict(self.flags)},
+                'temperature': self.temperature(),
+                }
+
+    def current(self):
+        t = self.temperature()
+        t['time'] = int(time.time())
+        with self.lock:
+            logs, self.logs = self.logs, []
+        return {'current': {'state': {'text': self.state, 'flags': dict(self.flags)}, 'temps': [t], 'logs': logs}}
+
+    def run_gcode(self, line):
+        self.commands.append(line)
+        words = line.split()
+        if not words:
+            return
+        args = dict((w[0], w[1:]) for w in words[1:] if w)
+        with self.lock:
+            self.toolhead.feed(line)
+            if words[0] == 'M114':
+                self.logs.append('Recv: X:%.2f Y:%.2f Z:%.2f E:%.2f Count X:0 Y:0 Z:0'%tuple(
+                    self.toolhead.position(axis) for axis in 'XYZE'))
+            elif words[0] == 'M104' and 'S' in args:
+                self.temps['tool0'][1] = float(args['S'])
+            elif words[0] == 'M140' and 'S' in args:
+                self.temps['bed'][1] = float(args['S'])
+
+    def listing(self):
+        # (ETag, body) of api/files?recursive=true
+        with self.lock:
+            body = {'files': [{'name': 'parts', 'path': 'parts', 'type': 'folder', 'children': self.files}]}
+        etag = '"%s"'%hashlib.md5(json.dumps(body, sort_keys=True).encode('utf-8')).hexdigest()
+        return etag, body
+
+    def gcode(self, path):
+        # content of a library file: a few layers of circles, or None if unknown
+        with self.lock:
+            if not any(f['path'] == path for f in self.files):
+                return None
+        lines = ['M82', 'G28', 'G92 E0']
+        e = 0
+        for layer in range(1, 51):
+            lines.append('G1 Z%.2f F600'%(layer*0.2))
+            for ring in range(5):
+                r = 20 + ring*2 + layer*0.2
+                lines.append('G0 X%.2f Y110'%(110 + r))
+                for a in range(1, 37):
+                    e += 0.05
+                    lines.append('G1 X%.2f Y%.2f E%.4f'%(110 + r*math.cos(a/36.0*2*math.pi), 110 + r*math.sin(a/36.0*2*math.pi), e))
+        return ('\n'.join(lines) + '\n').encode('ascii')
+
+    def select(self, path, start):
+        with self.lock:
+            for f in self.files:
+                if f['path'] == path:
+                    if start:
+                        f['prints'] = {'last': {'date': int(time.time()), 'success': True}}
+                    break
+            else:
+                return False
+        if start:
+            self.job({'command': 'start'})
+        return True
+
+    def job(self, params):
+        cmd = params.get('command')
+        if cmd == 'pause':
+            self.flags['paused'] = params.get('action') != 'resume'
+        elif cmd == 'cancel':
+            self.flags['printing'] = self.flags['paused'] = False
+        elif cmd in ('start', 'restart'):
+            self.flags['printing'] = True
+        self.state = 'Paused' if self.flags['paused'] else ('Printing' if self.flags['printing'] else 'Operational')
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    printer = None # FakePrinter, set by serve()
+    latency = 0.0 # seconds added before every REST reply
+    jitter = 0.0 # random extra delay, up to this many seconds
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _reply(self, code, data=None, headers=None):
+        if self.latency or self.jitter:
+            time.sleep(self.latency + random.random()*self.jitter)
+        body = json.dumps(data).encode('utf-8') if data is not None else b''
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        if path == '/api/printer':
+            status = self.printer.status()
+            for part in parse_qs(self.path.split('?', 1)[-1]).get('exclude', [''])[0].split(','):
+                status.pop(part, None)
+            self._reply(200, status)
+        elif path.startswith('/downloads/files/local/'):
+            data = self.printer.gcode(unquote(path[len('/downloads/files/local/'):]))
+            if data is None:
+                return self._reply(404, {'error': 'not found'})
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        elif path == '/api/files':
+            etag, body = self.printer.listing()
+            if self.headers.get('If-None-Match') == etag:
+                self._reply(304, headers={'ETag': etag})
+            else:
+                self._reply(200, body, {'ETag': etag})
+        else:
+            self._reply(404, {'error': 'not found'})
+
+    def do_POST(self):
+        path = self.path.split('?', 1)[0]
+        body = self._body()
+        if path.startswith('/sockjs/'):
+            if path.endswith('/xhr_streaming'):
+                return self._stream()
+            return self._reply(204) # xhr_send
+        data = json.loads(body.decode('utf-8')) if body else {}
+        if path == '/api/printer/command':
+            for line in data.get('commands') or [data.get('command', '')]:
+                self.printer.run_gcode(line)
+            self._reply(204)
+        elif path == '/api/job':
+            self.printer.job(data)
+            self._reply(204)
+        elif path == '/api/connection':
+            self._reply(204)
+        elif path.startswith('/api/files/'):
+            origin_path = unquote(path[len('/api/files/'):]).split('/', 1)
+            if len(origin_path) == 2 and self.printer.select(origin_path[1], data.get('print')):
+                self._reply(204)
+            else:
+                self._reply(404, {'error': 'not found'})
+        elif path == '/api/login':
+            self._reply(200, {'name': '_api', 'session': 'fake'})
+        else:
+            self._reply(404, {'error': 'not found'})
+
+    def _stream(self):
+        # SockJS xhr-streaming: a 2KB prelude, the "o" open frame, then "a" message frames
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/javascript; charset=UTF-8')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        def frame(text):
+            data = (text + '\n').encode('utf-8')
+            self.wfile.write(('%x\r\n'%len(data)).encode('ascii') + data + b'\r\n')
+            self.wfile.flush()
+
+        try:
+            frame('h'*2048)
+            frame('o')
+            frame('a' + json.dumps([json.dumps({'connected': {'version': 'fake'}})]))
+            while True:
+                frame('a' + json.dumps([json.dumps(self.printer.current())]))
+                time.sleep(PUSH_INTERVAL)
+        except (IOError, OSError):
+            pass
+        self.close_connection = True
+
+
+class FakeOctoPrint(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def serve(port=5000, host='127.0.0.1', printer=None, latency=0.0, jitter=0.0):
+    # Returns the running server (in a background thread), use server.shutdown() to stop it
+    handler = type('BoundHandler', (Handler,), {'printer': printer or FakePrinter(), 'latency': latency, 'jitter': jitter})
+    server = FakeOctoPrint((host, port), handler)
+    server.printer = handler.printer
+
+    def heat():
+        while True:
+            server.printer.step()
+            time.sleep(PUSH_INTERVAL)
+
+    for target in (server.serve_forever, heat):
+        t = threading.Thread(target=target)
+        t.daemon = True
+        t.start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Fake OctoPrint server')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every reply')
+    parser.add_argument('--jitter', type=float, default=0.0, help='max random seconds added to every reply')
+    parser.add_argument('--files', type=int, default=20, help='number of G-code files in the library')
+    args = parser.parse_args()
+    serve(args.port, args.host, FakePrinter(args.files), latency=args.latency, jitter=args.jitter)
+    print("Fake OctoPrint listening on http://%s:%d/"%(args.host, args.port))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,108 @@
+import json
+import time
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from polling import PollScheduler, POLL_PARTS
+
+FARM_WORKERS = 4 # max number of printers polled at the same time
+FARM_POLLING_INTERVAL = 5.0 # seconds, base polling interval of the printers in the background
+
+# One managed printer: name shown in the overview, OctoPrint host, API key, serial port & speed
+PrinterConfig = namedtuple('PrinterConfig', 'name host api_key port baudrate')
+
+
+class FarmError(Exception):
+    pass
+
+
+def load_farm(path):
+    # Reads the list of printers from a JSON file:
+    #   [{"name": "left", "host": "10.0.0.11", "api_key": "...", "port": "/dev/ttyACM0", "baudrate": 115200}, ...]
+    # only "host" & "api_key" are required
+    try:
+        with open(path) as f:
+            entries = json.load(f)
+    except (IOError, OSError, ValueError) as e:
+        raise FarmError('%s: %s'%(path, e))
+    if not isinstance(entries, list) or not entries:
+        raise FarmError('%s: expected a non empty list of printers'%path)
+    printers = []
+    for i, entry in enumerate(entries):
+        if 'host' not in entry or 'api_key' not in entry:
+            raise FarmError('%s: printer #%d needs a "host" and an "api_key"'%(path, i+1))
+        printers.append(PrinterConfig(entry.get('name') or entry['host'], entry['host'], entry['api_key'],
+            entry.get('port', '/dev/ttyACM0'), int(entry.get('baudrate', 115200))))
+    return printers
+
+
+class FarmCollector:
+    # Polls the status of the printers in the background (all but the `active` one, which has its
+    # own IOEngine), FARM_WORKERS at a time, each one on its own PollScheduler.
+    # Every status is reported to on_result('farm', index, None) from a worker thread.
+
+    def __init__(self, printers, interval=FARM_POLLING_INTERVAL, workers=FARM_WORKERS, on_result=None):
+        self.printers = printers # PrintCommands
+        self.schedulers = [PollScheduler(interval) for _ in printers]
+        self.workers = workers
+        self.on_result = on_result
+        self.active = None # index of the printer left out
+        self._busy = set()
+        self._running = False
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pool = None
+
+    def start(self):
+        self._running = True
+        self._pool = ThreadPoolExecutor(max_workers=self.workers)
+        self._thread = threading.Thread(target=self._loop, name='farm-collector')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=1.0):
+        self._running = False
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        if self._pool:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+
+    def set_active(self, index):
+        self.active = index
+        self._wake.set()
+
+    def _poll(self, index):
+        printer = self.printers[index]
+        polled = printer.transport_lock.acquire(False) # else it just became the active one, its IOEngine has it
+        try:
+            if polled:
+                try:
+                    printer.fetch_status()
+                finally:
+                    printer.transport_lock.release()
+        finally:
+            with self._lock:
+                self._busy.discard(index)
+            self.schedulers[index].polled(POLL_PARTS, printer.status)
+            self._wake.set()
+        if polled and self.on_result:
+            self.on_result('farm', index, None)
+
+    def _loop(self):
+        while self._running:
+            now = time.time()
+            with self._lock:
+                due = [i for i, s in enumerate(self.schedulers)
+                        if i != self.active and i not in self._busy and s.next_poll() <= now]
+                self._busy.update(due)
+            for index in due:
+                self._pool.submit(self._poll, index)
+            with self._lock:
+                waiting = [s.next_poll() for i, s in enumerate(self.schedulers) if i != self.active and i not in self._busy]
+            self._wake.wait(max(0.05, min(waiting) - time.time()) if waiting else None)
+            self._wake.clear()
@@ -0,0 +1,103 @@
+import os
+import re
+import json
+from collections import namedtuple
+
+from observable import Observable
+
+FILES_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'pgui4o') # local copies of the file listings
+
+# A printable file of the OctoPrint library, last_print is the date of its last print (or 0)
+FileEntry = namedtuple('FileEntry', 'name path origin size date last_print')
+
+
+def cache_path(base_url, cache_dir=FILES_CACHE_DIR):
+    return os.path.join(cache_dir, 'files-%s.json'%re.sub(r'[^\w.-]+', '_', base_url.split('://', 1)[-1]).strip('_'))
+
+
+def _flatten(nodes, out):
+    # api/files?recursive=true returns a tree of folders, only the G-code files are kept
+    for node in nodes:
+        if node.get('type') == 'folder':
+            _flatten(node.get('children') or [], out)
+        elif node.get('type', 'machinecode') == 'machinecode':
+            last = ((node.get('prints') or {}).get('last') or {}).get('date') or 0
+            out.append(FileEntry(node['name'], node.get('path', node['name']), node.get('origin', 'local'),
+                node.get('size') or 0, node.get('date') or 0, last))
+    return out
+
+
+class FileList:
+    # Local copy of OctoPrint's file listing, kept on disk with the validators of the reply
+    # (ETag, Last-Modified): refreshing it is a conditional request, answered by an empty
+    # "304 Not Modified" unless the library changed.
+
+    version = Observable(0) # bumped when the listing changes
+
+    def __init__(self, path=None):
+        self.path = path
+        self.entries = () # newest first
+        self.etag = None
+        self.last_modified = None
+        if path:
+            self.load()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def headers(self):
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    def update(self, response):
+        # Takes the reply of api/files, returns True if the listing changed
+        if response.status_code == 304:
+            return False
+        if response.status_code != 200:
+            raise RuntimeError(response.text)
+        self.set_entries(_flatten(response.json().get('files', []), []))
+        self.etag = response.headers.get('ETag')
+        self.last_modified = response.headers.get('Last-Modified')
+        self.save()
+        return True
+
+    def set_entries(self, entries):
+        self.entries = tuple(sorted(entries, key=lambda e: e.date, reverse=True))
+        self.version += 1
+
+    def page(self, index, rows):
+        return self.entries[index*rows:(index+1)*rows]
+
+    def page_count(self, rows):
+        return (len(self.entries) + rows - 1) // rows
+
+    def last_printed(self):
+        printed = [e for e in self.entries if e.last_print]
+        return max(printed, key=lambda e: e.last_print) if printed else None
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                d = json.load(f)
+            self.set_entries(FileEntry(*e) for e in d['entries'])
+            self.etag = d.get('etag')
+            self.last_modified = d.get('last_modified')
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            pass # no usable copy: the first refresh fetches the whole listing
+
+    def save(self):
+        if not self.path:
+            return
+        try:
+            if not os.path.isdir(os.path.dirname(self.path)):
+                os.makedirs(os.path.dirname(self.path))
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(dict(etag=self.etag, last_modified=self.last_modified, entries=self.entries), f)
+            os.rename(tmp, self.path)
+        except (IOError, OSError) as e:
+            print("Can't save the file listing: %s"%e)
@@ -0,0 +1,125 @@
+#!/bin/env python
+# Direct output to a Linux framebuffer (SPI LCDs exposed as /dev/fbN), without SDL's
+# display surfaces: frames are converted to RGB565 by a blit (SDL does it in bulk, in C)
+# and only the damaged areas are copied to the memory mapped device.
+#
+# A regular file out of /dev can stand for the device (size given by the UI), to look at the result:
+#   python framebuffer.py fb.raw 480x320 frame.png
+
+import os
+import sys
+import mmap
+import stat
+
+import pygame
+
+FB_DEPTH = 16 # bits per pixel of the supported framebuffers
+FB_MASKS = (0xF800, 0x07E0, 0x001F, 0) # RGB565
+
+
+class FramebufferError(Exception):
+    pass
+
+
+def _sysfs(device, name):
+    # /sys/class/graphics/fb1/<name> of /dev/fb1
+    with open(os.path.join('/sys/class/graphics', os.path.basename(device), name)) as f:
+        return f.read().strip()
+
+
+def is_device(path):
+    return os.path.exists(path) and stat.S_ISCHR(os.stat(path).st_mode)
+
+
+def geometry(path, size=None):
+    # (width, height, bits per pixel, bytes per line) of a framebuffer device,
+    # a plain file out of /dev is a fake framebuffer of the given size
+    if is_device(path):
+        try:
+            width, height = [int(v) for v in _sysfs(path, 'virtual_size').split(',')]
+            bpp = int(_sysfs(path, 'bits_per_pixel'))
+            try:
+                stride = int(_sysfs(path, 'stride'))
+            except (IOError, OSError, ValueError):
+                stride = width * bpp // 8
+        except (IOError, OSError, ValueError) as e:
+            raise FramebufferError("Can't read the geometry of %s: %s"%(path, e))
+        return width, height, bpp, stride
+    if os.path.realpath(path).startswith('/dev/'): # a missing device isn't a file to create
+        raise FramebufferError('%s is not a framebuffer device'%path)
+    if not size:
+        raise FramebufferError('%s is not a framebuffer device, its size is needed'%path)
+    return size[0], size[1], FB_DEPTH, size[0] * FB_DEPTH // 8
+
+
+class Framebuffer:
+    # write(surface, rects) replaces display.flip()/display.update(rects)
+
+    def __init__(self, path, size=None):
+        self.path = path
+        self.width, self.height, bpp, self.stride = geometry(path, size)
+        if bpp != FB_DEPTH:
+            raise FramebufferError('%s: %d bits per pixel, only %d is supported'%(path, bpp, FB_DEPTH))
+        length = self.stride * self.height
+        if is_device(path):
+            self._fd = os.open(path, os.O_RDWR)
+        else: # fake framebuffer
+            self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            if os.fstat(self._fd).st_size < length:
+                os.ftruncate(self._fd, length)
+        self._map = mmap.mmap(self._fd, length, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        # frame in the framebuffer format, the damaged areas are converted into it
+        self._frame = pygame.Surface((self.width, self.height), 0, FB_DEPTH, FB_MASKS)
+        self._pitch = self._frame.get_pitch()
+
+    @property
+    def size(self):
+        return self.width, self.height
+
+    def write(self, surface, rects=None):
+        area = self._frame.get_rect()
+        rects = [area] if rects is None else [pygame.Rect(r).clip(area) for r in rects]
+        rects = [r for r in rects if r.w and r.h]
+        for rect in rects:
+            self._frame.blit(surface, rect, rect)
+        if not rects:
+            return
+        pixels = memoryview(self._frame.get_view('1')).cast('B')
+        try:
+            fb, pitch, stride = self._map, self._pitch, self.stride
+            for rect in rects:
+                if rect.w == self.width and pitch == stride: # whole lines: a single copy
+                    fb[rect.top*stride:rect.bottom*stride] = pixels[rect.top*pitch:rect.bottom*pitch]
+                    continue
+                start, length = rect.left*2, rect.w*2
+                for y in range(rect.top, rect.bottom):
+                    fb[y*stride+start:y*stride+start+length] = pixels[y*pitch+start:y*pitch+start+length]
+        finally:
+            pixels.release()
+
+    def read(self):
+        # Surface of the framebuffer content
+        surface = pygame.Surface((self.width, self.height), 0, FB_DEPTH, FB_MASKS)
+        pixels = memoryview(surface.get_view('1')).cast('B')
+        try:
+            line = self.width*2
+            for y in range(self.height):
+                pixels[y*self._pitch:y*self._pitch+line] = self._map[y*self.stride:y*self.stride+line]
+        finally:
+            pixels.release()
+        return surface
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            os.close(self._fd)
+            self._map = None
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 4:
+        print('Usage: %s <framebuffer file> <width>x<height> <picture.png>'%sys.argv[0])
+        sys.exit(1)
+    fb = Framebuffer(sys.argv[1], tuple(int(v) for v in sys.argv[2].split('x')))
+    pygame.image.save(fb.read(), sys.argv[3])
+    fb.close()
@@ -0,0 +1,125 @@
+import re
+
+AXES = ('X', 'Y', 'Z', 'E')
+
+_M114_REPLY = re.compile(r'X:(-?[0-9.]+) Y:(-?[0-9.]+) Z:(-?[0-9.]+) E:(-?[0-9.]+)')
+
+
+def parse_words(line):
+    # "G1 X10 Y-2.5 ; comment" -> ('G1', {'X': 10.0, 'Y': -2.5}), flags without value give None
+    line = line.split(';', 1)[0].strip().upper()
+    if not line:
+        return None, {}
+    words = line.split()
+    params = {}
+    for word in words[1:]:
+        try:
+            params[word[0]] = float(word[1:]) if len(word) > 1 else None
+        except ValueError:
+            pass
+    code = words[0]
+    if code[0] in 'GM' and '.' not in code: # G01 == G1
+        try:
+            code = '%s%d'%(code[0], int(code[1:]))
+        except ValueError:
+            pass
+    return code, params
+
+
+def parse_position(line):
+    # (X, Y, Z, E) of an M114 reply ("X:10.00 Y:0.00 Z:5.00 E:0.00 Count X:..."), or None
+    m = _M114_REPLY.search(line)
+    return tuple(float(v) for v in m.groups()) if m else None
+
+
+class GCodeState:
+    # Modal G-code interpreter following the commands sent to the printer, to know where the
+    # toolhead is without asking (Marlin semantics):
+    #  G90/G91 absolute/relative moves (M82/M83 for E only), G0/G1 moves, G92 set position,
+    #  G28 homing, M206 home offsets, M290 baby steps.
+    # Positions are logical ones (as M114 reports them): native position + M206 offset + G92 shift.
+    # `revision` is bumped on every change of the position.
+
+    def __init__(self):
+        self.relative = False
+        self.relative_e = False
+        self.native = dict((axis, 0.0) for axis in AXES)
+        self.home_offset = dict((axis, 0.0) for axis in AXES)
+        self.shift = dict((axis, 0.0) for axis in AXES) # G92
+        self.babystep = 0.0 # Z, in mm, not part of the coordinates
+        self.homed = set()
+        self.revision = 0
+
+    def position(self, axis):
+        return self.native[axis] + self.home_offset[axis] + self.shift[axis]
+
+    def feed(self, lines):
+        for line in ([lines] if isinstance(lines, str) else lines):
+            code, params = parse_words(line)
+            handler = getattr(self, '_' + code, None) if code else None
+            if handler:
+                handler(params)
+
+    def reconcile(self, x, y, z, e):
+        # trusts the position reported by the printer
+        for axis, value in zip(AXES, (x, y, z, e)):
+            self.native[axis] = value - self.home_offset[axis] - self.shift[axis]
+        self.revision += 1
+
+    def _G0(self, params):
+        moved = False
+        for axis in AXES:
+            value = params.get(axis)
+            if value is None:
+                continue
+            if self.relative or (axis == 'E' and self.relative_e):
+                self.native[axis] += value
+            else:
+                self.native[axis] = value - self.home_offset[axis] - self.shift[axis]
+            moved = True
+        if moved:
+            self.revision += 1
+
+    _G1 = _G0
+
+    def _G28(self, params):
+        axes = [axis for axis in AXES[:3] if axis in params] or AXES[:3]
+        for axis in axes:
+            self.native[axis] = 0.0
+            self.shift[axis] = 0.0
+            self.homed.add(axis)
+        if 'Z' in axes:
+            self.babystep = 0.0
+        self.revision += 1
+
+    def _G90(self, params):
+        self.relative = self.relative_e = False
+
+    def _G91(self, params):
+        self.relative = self.relative_e = True
+
+    def _M82(self, params):
+        self.relative_e = False
+
+    def _M83(self, params):
+        self.relative_e = True
+
+    def _G92(self, params):
+        axes = [axis for axis in AXES if axis in params]
+        if not axes: # "G92" alone resets every axis
+            axes = AXES
+        for axis in axes:
+            value = params.get(axis) or 0.0
+            self.shift[axis] = value - self.native[axis] - self.home_offset[axis]
+        self.revision += 1
+
+    def _M206(self, params):
+        for axis in AXES[:3]:
+            if params.get(axis) is not None:
+                self.home_offset[axis] = params[axis]
+        self.revision += 1
+
+    def _M290(self, params):
+        if params.get('Z') is not None:
+            self.babystep += params['Z']
+            self.revision += 1
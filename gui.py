@@ -4,14 +4,40 @@ import os
 import sys
 import time
 import math
+import functools
+import threading
 
 import pygame
 
-from printer import PrintCommands
+from printer import PrintCommands, IOEngine, PRIO_EMERGENCY
+from push import PushClient
+from textrender import TextRenderer
+from hitmap import HitMap
+from theme import load_theme, ThemeError
+from imagecache import ImageCache
+from atlas import load_cache
+from perf import counters, tracer, clock
+from observable import Observable, track, changed, cell
+from polling import POLL_PARTS, activity
+from farm import FarmCollector, PrinterConfig, load_farm, FarmError
+from framebuffer import Framebuffer, FramebufferError
+from touch import TouchTracker, coalesce_motion, FLING_VELOCITY
+from preview import load_index, render_layer, download_path, use_download, evict_downloads
 
 DRY_RUN = os.getenv('DRYRUN', False) # If True do not do anything (no HTTP requests)
 DEBUG_UI = os.getenv('DEBUG', False) # Show additional debugging information
 THEME = os.getenv('THEME', 'default')
+USE_PUSH = os.getenv('PUSH', False) # Follow OctoPrint's push API instead of polling the status
+PERF_HUD = os.getenv('PERF', False) # Show the performance counters overlay (toggle with P)
+PERF_DUMP = os.getenv('PERF_DUMP', '') # File receiving a JSON line of performance counters periodically
+PERF_DUMP_INTERVAL = 10.0 # seconds
+HUD_REFRESH = 0.5 # seconds between two updates of the performance overlay
+TRACE = os.getenv('TRACE', '') # File receiving a Chrome trace (touch to printer latency) on exit
+GCODE_DIR = os.getenv('GCODE_DIR', os.path.expanduser('~/.octoprint/uploads')) # OctoPrint's uploads, when on the same host
+BED_SIZE = tuple(int(v) for v in os.getenv('BED_SIZE', '220x220').split('x')) # mm, area shown by the G-code preview
+FRAMEBUFFER = os.getenv('FRAMEBUFFER', '') # framebuffer device (ex: /dev/fb1) written directly instead of the SDL display
+FARM = os.getenv('FARM', '') # JSON file listing the printers to manage (see farm.py), one printer if empty
+WIDGET_KINDS = ('icons', 'texts', 'rects', 'graphs') # in drawing order
 
 class UIOptions:
     def __init__(self, opts):
@@ -26,7 +52,8 @@ except NameError: # make python2 accept python3 exceptions
     FileNotFoundError = IOError
 
 try:
-    PRINT_API_KEY = open('API_KEY.txt').read().strip() # octoprint API key to generate from settings
+    # octoprint API key to generate from settings (given per printer in farm mode)
+    PRINT_API_KEY = os.getenv('OCTOPRINT_API_KEY') or ('' if FARM else open('API_KEY.txt').read().strip())
 except FileNotFoundError:
     print('ERROR: Write your API key in "API_KEY.txt" and retry please.')
     sys.exit(-1)
@@ -37,49 +64,132 @@ OCTOPRINT_HOSTNAME = os.getenv('OCTOPRINT_HOST', '127.0.0.1') # add /some_suffix
 
 RESX, RESY = (480, 320) # window size (pixels) - should match the LCD size
 PRINTER_POLLING_INTERVAL = 2.0 # seconds between periodic http requests
+IMAGE_CACHE_BUDGET = int(os.getenv('IMAGE_CACHE_MB', 16))*1024*1024 # memory allowed for the decoded pictures
 
 MIN_SWIPE_DISTANCE = 40 # minimum distance to travel to consider a swipe move
-SWIPE_ANIM_SPEED = 6000.0 # some factor applied to the render time
+FLING_MIN_DISTANCE = MIN_SWIPE_DISTANCE // 2 # pixels, a fast but shorter move is a jittery tap (resistive panels)
+SWIPE_ANIM_DURATION = 0.25 # seconds to complete the scrolling once the finger is released
+SWIPE_MIN_DURATION = 0.08 # seconds, shortest scrolling after a fast fling
+TARGET_FPS = 30 # frame rate while animating or dragging
+IDLE_TIMEOUT = 1000 # max milliseconds spent waiting for an event when nothing is going on
+FILE_ROWS = 4 # files per page of the file browser
+FILE_NAME_MAX = 26 # longer file names are shortened
+GRAPH_MIN_SPAN = 10 # smallest temperature range of a graph, in degrees
+# farm overview tile colors, per printer activity (see polling.py)
+FARM_COLORS = {'offline': (110, 40, 40), 'heating': (140, 90, 30), 'printing': (40, 100, 50), 'idle': (60, 60, 80)}
+FEEDBACK_DECAY = 100 # event feedback circle shrinking speed, per second
 
 # long click configuration
 REPEAT_INITIAL_DELAY = 600
 REPEAT_DELAY = 300
+# (seconds held, step multiplier): long press acceleration of jogs & setpoints
+REPEAT_ACCELERATION = ((0, 1), (1.5, 2), (3.0, 5), (5.0, 10))
 
 EVENT_REPEAT = pygame.USEREVENT + 1
-
-def getResourcesPath(filename):
-    paths = [os.path.join('themes', THEME, filename), os.path.join('assets', filename)]
-    for p in paths:
-        p = os.path.abspath(p)
-        if os.path.exists(p):
-            return p
-    return filename
+EVENT_IO = pygame.USEREVENT + 2 # posted by the I/O engine thread when a request completes
+
+def circle_rect(circle):
+    # bounding rect of a (color, center, radius) circle
+    (x, y), radius = circle[1], circle[2]
+    return pygame.Rect(x-radius, y-radius, radius*2+1, radius*2+1)
+
+def shorten(name, size=FILE_NAME_MAX):
+    return name if len(name) <= size else name[:size-3] + '...'
+
+def merge_rects(rects):
+    # Merges overlapping rectangles so that no area is repainted twice
+    merged = []
+    for rect in rects:
+        rect = pygame.Rect(rect)
+        if not (rect.w and rect.h):
+            continue
+        i = 0
+        while i < len(merged):
+            if merged[i].colliderect(rect):
+                rect.union_ip(merged.pop(i))
+                i = 0
+            else:
+                i += 1
+        merged.append(rect)
+    return merged
 
 class App: # View
+    # attributes read by the theme widgets: changes are tracked (see observable.py)
+    event_queue = Observable(0)
+    event_processed = Observable(False)
+    printer_info = Observable(None)
+    printer_name = Observable('') # printer driven by the pages, in farm mode
 
     # Binding UI items to controller commands (click dispatcher)
     # X1, Y1, X2, Y2 (top-left & bottom-right coordinates): handler function name
 
-    def __init__(self, actions, widgets):
-        self.actions = actions
-        self.widgets = widgets
-        self.page_count = len(widgets)
+    def __init__(self, theme, printers=None):
+        self.theme = theme
+        self.actions = theme.actions
+        self.widgets = theme.widgets
+        self.options = UIOptions(theme.options)
+        self.transformers = theme.transformers
+        self.page_count = theme.page_count
         self._running = True
         self._cur_page = 0
         self.last_update = 0
         self.size = [RESX, RESY]
         pygame.init()
-        self._screen = pygame.display.set_mode(self.size, pygame.HWSURFACE | pygame.DOUBLEBUF)
-        self._backgrounds = [pygame.image.load(getResourcesPath('screen%d.png'%(i+1))).convert() for i in range(self.page_count)]
+        if FRAMEBUFFER:
+            # SDL only provides the input events, frames are copied to the framebuffer by present()
+            self.output = Framebuffer(FRAMEBUFFER, self.size)
+            if self.output.size != tuple(self.size):
+                print('Framebuffer %s is %dx%d, the UI is drawn at %dx%d'%((FRAMEBUFFER,) + self.output.size + tuple(self.size)))
+            self._screen = pygame.display.set_mode(self.size)
+        else:
+            self.output = None
+            self._screen = pygame.display.set_mode(self.size, pygame.HWSURFACE | pygame.DOUBLEBUF)
+        self.images = ImageCache(IMAGE_CACHE_BUDGET)
+        precompiled = load_cache(theme) # else the PNG files are decoded on demand
+        if precompiled:
+            self.images.pin(precompiled)
+        self.text_renderer = TextRenderer()
         self.set_font(20)
         self.event_queue = 0
         self.grab_mode = False
         self.dirty = False
-        self.printer = PrintCommands('http://%s/'%OCTOPRINT_HOSTNAME, PRINT_API_KEY, PORT, BAUD)
+        # One PrintCommands & IOEngine per printer, only the engine of the selected printer runs,
+        # the other printers are polled in the background by the farm collector
+        configs = printers or [PrinterConfig(OCTOPRINT_HOSTNAME, OCTOPRINT_HOSTNAME, PRINT_API_KEY, PORT, BAUD)]
+        self.printer_names = [c.name for c in configs]
+        self.printers = [PrintCommands('http://%s/'%c.host, c.api_key, c.port, c.baudrate) for c in configs]
+        self.engines = [IOEngine(p, PRINTER_POLLING_INTERVAL, on_result=self.on_io_result) for p in self.printers]
+        if USE_PUSH and not DRY_RUN:
+            for engine in self.engines:
+                engine.push = PushClient(engine.printer, on_update=lambda status: self.on_io_result('status', status, None))
+        self.farm = FarmCollector(self.printers, on_result=self.on_io_result) if len(self.printers) > 1 else None
+        self.printer, self.io = self.printers[0], self.engines[0]
+        self.printer_info = self.printer.status.temperatures
+        if self.farm:
+            self.farm.set_active(0)
+            self.printer_name = self.printer_names[0]
         self.mouse_pos = (0, 0)
+        self.touch = TouchTracker()
         self.key_presses = {}
         self.last_action_failed = False
-        self._ui_draw_time = 1
+        self._popups = []
+        self._pending_actions = []
+        self._last_status = None
+        self.event_processed = False
+        self._swipe = None # running swipe animation
+        self._full_redraw = True
+        self._drawn_state = None
+        self._drawn_items = []
+        self._widget_values = {} # (page, kind, index): (handler result, observables read)
+        self._snapshots = {} # page: (composed surface, observables read, item keys if some widgets read none, font size)
+        self._drawn_feedback = None
+        self._drawn_hud = None
+        self._hud = None
+        self.hud = False
+        counters.enabled = bool(PERF_DUMP)
+        tracer.enabled = bool(TRACE)
+        if PERF_HUD:
+            self.toggle_hud()
 
         if DRY_RUN:
             class _DummyHttpModule:
@@ -91,12 +201,16 @@ class App: # View
                     print("Dummy HTTP %s %s %s"%(self.name, args, kw))
                     raise RuntimeError('Dry run... calls will fail')
 
-            self.printer.http = _DummyHttpModule()
+            for printer in self.printers:
+                printer.http = printer.emergency_http = _DummyHttpModule()
         else:
-            if not DEBUG_UI and not os.getenv('NOFS'):
+            if not DEBUG_UI and not os.getenv('NOFS') and not self.output:
                 self.ui_toggle_fullscreen()
 
         self.ui_actions = { 'quit': self.quit }
+        self.hitmaps = [self.compile_actions(page_actions, i) for i, page_actions in enumerate(self.actions)]
+        if self.farm:
+            self.ui_farm_overview()
 
     def set_font(self, size=20):
         if not getattr(self, '_font_size', None) or size != self._font_size:
@@ -110,7 +224,7 @@ class App: # View
                     self.font = pygame.font.SysFont("impact", self._font_size)
                     print("Found the system font")
                 except Exception:
-                    self.font = pygame.font.Font(getResourcesPath("impact.ttf"), self._font_size)
+                    self.font = pygame.font.Font(self.theme.resource_path("impact.ttf"), self._font_size)
 
             if size not in fonts:
                 fonts[size] = self.font
@@ -118,6 +232,7 @@ class App: # View
 
     def ui_toggle_fullscreen(self):
         pygame.display.toggle_fullscreen()
+        self.invalidate()
 
     def ui_main_page(self):
         self._cur_page = 0
@@ -176,94 +291,294 @@ class App: # View
             'captions' : ['resume', 'restart', 'cancel', 'close popup'],
             })
 
+    def ui_farm_overview(self):
+        # Farm mode: one tile per printer, clicking a tile shows its pages
+        if self.farm:
+            self.add_popup(self.farm_popup())
+
+    def farm_popup(self):
+        count = len(self.printers)
+        cols = int(math.ceil(math.sqrt(count)))
+        rows = (count + cols - 1) // cols
+        w, h = self.size[0] // cols, self.size[1] // rows
+        image = pygame.Surface(self.size)
+        image.fill((100, 100, 120))
+        self.set_font(16 if rows > 2 else 20)
+        color = tuple(self.options.default_text_color)
+        rects, actions = [], []
+        for i, (name, printer) in enumerate(zip(self.printer_names, self.printers)):
+            x, y = (i % cols)*w, (i // cols)*h
+            status = printer.status
+            pygame.draw.rect(image, FARM_COLORS[activity(status)], (x+2, y+2, w-4, h-4))
+            if printer is self.printer: # the one the pages show
+                pygame.draw.rect(image, color, (x+2, y+2, w-4, h-4), 2)
+            lines = [name, 'offline' if status.offline else status.status_text]
+            lines.extend('%s %.0f/%d'%(heater[0].upper(), actual, target) for heater, (actual, target) in sorted(status.temperatures.items()))
+            for j, line in enumerate(lines):
+                self.text_renderer.draw(image, self.font, self._font_size, shorten(line, w // (self._font_size // 2)), color,
+                        (x + 8, y + 6 + j*(self._font_size + 4)))
+            rects.append((x, y, x+w, y+h))
+            actions.append(lambda i=i: self.select_printer(i))
+        return {'actions': actions, 'captions': ['']*count, 'rects': rects, 'image': image, 'farm': True}
+
+    def select_printer(self, index):
+        # Drill-down: the pages now drive printers[index], polled by its own IOEngine
+        printer = self.printers[index]
+        if printer is self.printer:
+            return
+        if self.io.push:
+            self.io.push.stop()
+        self.io.stop() # not waiting: the new engine doesn't share anything with it
+        self.io.dispatcher.flush(PRIO_EMERGENCY, 'printer switched') # reported as failed, not sent to the new printer
+        self.printer, self.io = printer, self.engines[index]
+        self.farm.set_active(index)
+        self.io.start()
+        if self.io.push:
+            self.io.push.start()
+        self.printer_name = self.printer_names[index]
+        self._widget_values = {}
+        self._snapshots = {} # they follow the observables of the previous printer
+        self._last_status = None
+        self._drawn_state = None # the visible parts are given to the new engine
+        self.invalidate()
+
+    def ui_file_browser(self):
+        # Shows the local copy of the file listing at once, and asks for a refresh
+        # (see on_io_event)
+        self.printer.fetch_files()
+        self.add_popup(self.file_popup(0))
+
+    def file_popup(self, page):
+        # One page of the file browser: "re-print last", FILE_ROWS files & the navigation row,
+        # only the visible rows are built
+        files = self.printer.files
+        pages = max(1, files.page_count(FILE_ROWS))
+        page %= pages
+        actions, captions = [], []
+        last = files.last_printed()
+        if last:
+            actions.append(lambda entry=last: self.printer.print_file(entry))
+            captions.append('re-print %s'%shorten(last.name))
+        for entry in files.page(page, FILE_ROWS):
+            actions.append(lambda entry=entry: self.ui_preview_file(entry))
+            captions.append(shorten(entry.name))
+        if not files:
+            actions.append('')
+            captions.append('no files')
+        actions.append(lambda x, y: self._browse_files(page, x))
+        captions.append('<<%s%d/%d close%s>>'%(' '*14, page+1, pages, ' '*20))
+        return {'actions': actions, 'captions': captions, 'file_page': page}
+
+    def gcode_path(self, entry):
+        # (path, available) of the local copy of a library file: OctoPrint's own uploads
+        # folder when running on the same host, a download otherwise
+        uploaded = os.path.join(GCODE_DIR, entry.path)
+        if entry.origin == 'local' and os.path.exists(uploaded):
+            return uploaded, True
+        path = download_path(entry)
+        return path, os.path.exists(path) and os.path.getsize(path) == entry.size
+
+    def ui_preview_file(self, entry):
+        # Shows a waiting popup, replaced by the layer preview once the file is local
+        # & indexed by a worker thread (see on_io_event)
+        self.add_popup({'actions': ['', ''], 'captions': ['loading %s'%shorten(entry.name), 'close'], 'loading': entry})
+        t = threading.Thread(target=self._load_preview, args=(entry,), name='gcode-preview')
+        t.daemon = True
+        t.start()
+
+    def _load_preview(self, entry):
+        # reports ('preview', (entry, index or None), error)
+        try:
+            path, available = self.gcode_path(entry)
+            if not available:
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                self.printer.download_file(entry, path)
+                evict_downloads(path)
+            elif path == download_path(entry):
+                use_download(path)
+            result = (entry, load_index(path))
+        except Exception as e:
+            self.on_io_result('preview', (entry, None), e)
+        else:
+            self.on_io_result('preview', result, None)
+
+    def preview_popup(self, entry, index, layer):
+        # The layer on the left, its controls in the right column
+        side = self.size[1]
+        layer = max(0, min(len(index)-1, layer))
+        if len(index):
+            image = render_layer(index, layer, (side, side), BED_SIZE)
+            label = 'Z%.2f  %d/%d'%(index.heights[layer], layer+1, len(index))
+        else:
+            image = pygame.Surface((side, side))
+            label = 'no layers'
+        self.set_font(20)
+        self.text_renderer.draw(image, self.font, self._font_size, label, tuple(self.options.default_text_color), (4, 4))
+        height = self.size[1] // 4
+        return {
+                'actions': [lambda: self._preview_step(entry, index, layer, 1), lambda: self._preview_step(entry, index, layer, -1),
+                    lambda: self.printer.print_file(entry), ''],
+                'captions': ['layer +', 'layer -', 'print', 'close'],
+                'rects': [(side, i*height, self.size[0], (i+1)*height) for i in range(4)],
+                'font_size': 30,
+                'image': image,
+                }
+
+    def _preview_step(self, entry, index, layer, direction):
+        # long presses go through the layers faster (see REPEAT_ACCELERATION)
+        self.add_popup(self.preview_popup(entry, index, layer + direction*self.printer.step_scale))
+
+    def _browse_files(self, page, x):
+        # navigation row: previous page on the left third, next page on the right one
+        step = int(x * 3 // self.size[0]) - 1
+        if step:
+            self.add_popup(self.file_popup(page + step))
+
     def ui_remove_popup(self):
         self._popups.pop(0)
         self.set_font()
+        self.invalidate()
 
     def add_popup(self, popup):
+        # popup: 'actions' (names or handlers) & their 'captions', stacked as full width rows
+        # unless 'rects' are given, optional 'image' (surface) drawn at the top left corner
+        height = self.size[1]/len(popup['actions'])
+        rects = popup.get('rects') or [(i, height*i, self.size[0], height*(i+1)) for i in range(len(popup['actions']))]
+        popup['hitmap'] = self.compile_actions(dict(zip(rects, popup['actions'])))
         popups = getattr(self, '_popups', [])
         popups.append(popup)
         self._popups = popups
 
-    def run_action_at(self, x, y):
+    def resolve_action(self, name):
+        if callable(name):
+            return name
+        if name.startswith('ui_'):
+            fn = getattr(self, name, None)
+        elif callable(getattr(self.printer, name, None)):
+            fn = self._active_printer_action(name)
+        else:
+            fn = None
+        transformer = self.transformers.get(name)
+        if fn and transformer:
+            return lambda x, y: fn(transformer.to_value(x, y))
+        return fn
+
+    def _active_printer_action(self, name):
+        # method of the printer the pages drive when called (farm mode): the hit maps are
+        # compiled once, whatever printer is selected later
+        method = getattr(self.printer, name)
+        @functools.wraps(method) # same signature, see hitmap.Action
+        def call(*args):
+            return getattr(self.printer, name)(*args)
+        return call
+
+    def compile_actions(self, actions, page=None):
+        hitmap = HitMap(actions, self.resolve_action, self.size)
+        where = 'popup' if page is None else 'page %d'%page
+        for name in hitmap.unknown:
+            print("Theme: unknown action %r on %s"%(name, where))
+        for a, b in hitmap.overlaps:
+            print("Theme: overlapping actions on %s: %r hides %r"%(where, a, b))
+        return hitmap
 
-        def action_match(name, coords):
-            if x > coords[0] and x < coords[2] and y > coords[1] and y < coords[3]:
-                if not name: # Allow "no op" actions
-                    return True
-                if name.startswith('ui_'):
-                    fn = getattr(self, name, None)
-                else:
-                    fn = getattr(self.printer, name, None)
-
-                if fn:
-                    try:
-                        try:
-                            action = fn(x, y)
-                        except TypeError:
-                            action = fn()
-                        self.event_processed = True
-                        self.last_action_failed = False
-                        return True # stop on first match
-                    except Exception as e:
-                        self.last_action_failed = True
-                        action = None
-                        self.event_processed = -1
-                        print("Error while running %s: %s"%(name, e))
-                        return True
-                    finally:
-                        self.dirty = True
-                        if self.event_queue < 100:
-                            self.event_queue += 50
-                        if isinstance(action, set):
-                            for act in action:
-                                self.ui_actions[act]()
-            return False
+    def run_action_at(self, x, y):
+        with tracer.span('run_action_at', pos=(x, y)):
+            self._run_action_at(x, y)
 
-        if self._popups:
-            actions = self._popups[0]['actions']
-            height = self.size[1]/len(actions)
-            for i, action in enumerate(actions):
-                if action_match(action, (i, height*i, self.size[0], height*(i+1))):
-                    self.ui_remove_popup()
-                    break
+    def _run_action_at(self, x, y):
+        in_popup = bool(self._popups)
+        if in_popup:
+            action = self._popups[0]['hitmap'].find(x, y)
         else:
-            for coords, name in self.actions[self._cur_page].items():
-                if action_match(name, coords):
-                    break
-
+            action = self.hitmaps[self._cur_page].find(x, y)
+
+        if action is None:
+            return
+
+        if action.fn: # else "no op" action
+            result = None
+            try:
+                result = action(x, y)
+                self.event_processed = True
+                self.last_action_failed = False
+            except Exception as e:
+                self.last_action_failed = True
+                self.event_processed = -1
+                print("Error while running %s: %s"%(action.name, e))
+            finally:
+                self.dirty = True
+                if self.event_queue < 100:
+                    self.event_queue += 50
+                if isinstance(result, set):
+                    for act in result:
+                        self.ui_actions[act]()
+
+        if in_popup: # the clicked popup goes away, not the one the action may have opened
+            self.ui_remove_popup()
+
+    def swipe_direction(self, offset, speed):
+        # Page change at the end of a drag: a fling decides by itself (flung back: cancelled),
+        # else the distance travelled
+        if abs(speed) >= FLING_VELOCITY:
+            direction = 1 if speed > 0 else -1
+            return direction if direction*offset > 0 else 0
+        return (1 if offset > 0 else -1) if abs(offset) > MIN_SWIPE_DISTANCE else 0
 
     def on_click_release(self, x, y):
-        direction = self.is_swiping(x, y)
+        moved, velocity = self.touch.release((x, y))
+        axis = 1 if self.options.vertical_swipe else 0
+        offset, speed, size = moved[axis], velocity[axis], self.size[axis]
+        dragged = abs(offset) > MIN_SWIPE_DISTANCE or (abs(speed) >= FLING_VELOCITY and abs(offset) >= FLING_MIN_DISTANCE)
+
+        if dragged and not self._repeated: # Swiping !
+            # animate the rest of the scrolling from the main loop, back to the page if cancelled,
+            # at the speed of the finger
+            direction = self.swipe_direction(offset, speed)
+            end = direction*size
+            duration = SWIPE_ANIM_DURATION
+            if speed:
+                duration = max(SWIPE_MIN_DURATION, min(SWIPE_ANIM_DURATION, 3.0*abs(end - offset)/abs(speed)))
+            self._swipe = dict(start_time=time.time(), start=offset, end=end, offset=offset, duration=duration,
+                    page=self.get_next_page(-direction)%self.page_count if direction else self._cur_page)
+        else:
+            self.run_action_at(x, y)
+
+        self.dirty = True
+        self.grab_mode = False
 
-        if direction and not self._repeated: # Swiping !
-            new_page = self.get_next_page(-direction)
+    def animate(self):
+        # Advances the swipe animation (ease out), according to the elapsed time
+        swipe = self._swipe
+        if not swipe:
+            return
+        progress = (time.time() - swipe['start_time']) / swipe.get('duration', SWIPE_ANIM_DURATION)
+        if progress >= 1.0:
+            self.finish_swipe()
+        else:
+            eased = 1.0 - (1.0 - progress)**3
+            swipe['offset'] = int(swipe['start'] + (swipe['end'] - swipe['start'])*eased)
+        self.dirty = True
 
-            delta = max(1, int(self._ui_draw_time * SWIPE_ANIM_SPEED))
+    def finish_swipe(self):
+        if self._swipe:
+            self._cur_page = self._swipe['page']
+            self._swipe = None
+            self.dirty = True
 
-            # animate the rest of the scrolling
+    def get_swipe_offset(self):
+        if self._popups:
+            return (0, 0)
+        if self._swipe:
+            offset = self._swipe['offset']
+        elif self.grab_mode:
             if self.options.vertical_swipe:
-                if direction < 0:
-                    r = range(y, self.click_grab_start[1]-self.size[1],  direction*delta)
-                else:
-                    r = range(y, self.click_grab_start[1]+self.size[1], direction*delta)
-                for yo in r:
-                    self.click_grab_cur = (0, yo)
-                    self.draw_ui()
+                offset = self.click_grab_cur[1] - self.click_grab_start[1]
             else:
-                if direction < 0:
-                    r = range(x, self.click_grab_start[0]-self.size[0],  direction*delta)
-                else:
-                    r = range(x, self.click_grab_start[0]+self.size[0], direction*delta)
-                for xo in r:
-                    self.click_grab_cur = (xo, 0)
-                    self.draw_ui()
-            self._cur_page = (new_page%self.page_count)
+                offset = self.click_grab_cur[0] - self.click_grab_start[0]
         else:
-            self.run_action_at(x, y)
-
-        self.dirty = True
-        self.grab_mode = False
+            return (0, 0)
+        return (0, offset) if self.options.vertical_swipe else (offset, 0)
 
     def on_repeat(self, x, y):
         if self.grab_mode: # first repeat
@@ -276,11 +591,18 @@ class App: # View
                 self._repeated = True # turn on repeat
                 pygame.time.set_timer(EVENT_REPEAT, REPEAT_DELAY) # repeat every 0.3s
 
-        # normal repeat
-        self.run_action_at(x, y)
+        # normal repeat, steps get bigger as the button is held
+        held = time.time() - self._click_time
+        self.printer.step_scale = [scale for delay, scale in REPEAT_ACCELERATION if held >= delay][-1]
+        try:
+            self.run_action_at(x, y)
+        finally:
+            self.printer.step_scale = 1
 
     def on_click(self, x, y):
         self._repeated = False
+        self._click_time = time.time()
+        self.finish_swipe()
 
         if DEBUG_UI:
             print("%d , %d"%((x, y)))
@@ -293,6 +615,39 @@ class App: # View
 
         self.grab_mode = True
         self.click_grab_cur = self.click_grab_start = (x, y)
+        self.touch.press((x, y))
+
+    def on_io_result(self, name, result, error):
+        # Called from the I/O thread: only hand the result over to the main loop
+        pygame.event.post(pygame.event.Event(EVENT_IO, name=name, result=result, error=error, trace=tracer.current()))
+
+    def on_io_event(self, event):
+        if event.trace is not None:
+            tracer.request_done(event.trace)
+        if event.name not in ('status', 'farm'):
+            self.last_action_failed = event.error is not None
+            if event.error is not None:
+                self.event_processed = -1
+                print("Error while running %s: %s"%(event.name, event.error))
+        if event.name in ('connect', 'job', 'print_file') and event.error is None:
+            self.io.poll_now() # don't wait for the next (maybe backed off) poll to show the new state
+        if event.name == 'preview' and self._popups and self._popups[0].get('loading') == event.result[0]:
+            if event.error is None:
+                popup = self.preview_popup(event.result[0], event.result[1], 0)
+            else:
+                popup = {'actions': ['', ''], 'captions': ['no preview: %s'%shorten(str(event.error)), 'close']}
+            self.add_popup(popup) # replaces the waiting popup
+            self._popups[0] = self._popups.pop()
+            self.invalidate()
+        if event.name == 'files' and event.result and self._popups and 'file_page' in self._popups[0]:
+            self.add_popup(self.file_popup(self._popups[0]['file_page'])) # the listing changed
+            self._popups[0] = self._popups.pop()
+            self.invalidate()
+        if event.name in ('farm', 'status') and self._popups and self._popups[0].get('farm'):
+            self.add_popup(self.farm_popup()) # a printer of the overview changed, the active one included
+            self._popups[0] = self._popups.pop()
+            self.invalidate()
+        self.dirty = True
 
     def process_event(self, event):
         if event.type == pygame.QUIT:
@@ -306,108 +661,361 @@ class App: # View
                 elif event.unicode == 'f':
                     self.ui_toggle_fullscreen()
                     self.event_processed = True
+                elif event.unicode in 'pP':
+                    self.toggle_hud()
+                    self.event_processed = True
+                elif event.unicode in 'oO' and not self._popups:
+                    self.ui_farm_overview()
+                    self.event_processed = True
         elif event.type == EVENT_REPEAT:
             self.on_repeat(*self.click_grab_cur)
+        elif event.type == EVENT_IO:
+            self.on_io_event(event)
+        elif event.type == pygame.VIDEOEXPOSE:
+            self.invalidate()
         elif event.type == pygame.MOUSEBUTTONDOWN:
             pygame.time.set_timer(EVENT_REPEAT, REPEAT_INITIAL_DELAY) # start repeating after 1s
             if event.button == 1:
-                self.on_click(*event.pos)
+                tracer.start_touch(pos=event.pos)
+                with tracer.span('click'):
+                    self.on_click(*event.pos)
         elif event.type == pygame.MOUSEBUTTONUP:
             pygame.time.set_timer(EVENT_REPEAT, 0) # remove click repeat
-            self.on_click_release(*event.pos)
+            with tracer.span('click_release'):
+                self.on_click_release(*event.pos)
+            trace = tracer.current()
+            if trace is not None:
+                tracer.release_touch(trace)
+                tracer.set_current(None)
         elif event.type == pygame.MOUSEMOTION:
             self.mouse_pos = event.pos
             if DEBUG_UI:
                 self.dirty = True
             if self.grab_mode:
                 self.click_grab_cur = event.pos
+                self.touch.move(event.pos)
 
     def update(self):
-        if time.time() - self.last_update > PRINTER_POLLING_INTERVAL:
+        # status is polled by the I/O engine, just pick the latest snapshot
+        status = self.printer.status
+        if status is not self._last_status:
+            self._last_status = status
+            self.printer_info = status.temperatures
             self.last_update = time.time()
-            self.printer_info = self.printer.fetch_status()
             self.dirty = True
 
-    def render_text(self, text, x, y, color=None):
+    def render_text(self, text, x, y, color=None, surface=None):
         if not color:
             color = self.options.default_text_color
-        text = self.font.render(text, True, color)
-        self._screen.blit(text, (x, y))
+        return self.text_renderer.draw(surface or self._screen, self.font, self._font_size, text, tuple(color), (x, y))
 
-    def render_image(self, name, x, y):
-        cache = getattr(self, '_image_cache', dict())
-        if name in cache:
-            image = cache[name]
-        else:
-            image = pygame.image.load(getResourcesPath('%s.png'%name)).convert_alpha()
-            cache[name] = image
+    def load_image(self, name):
+        return self.images.get(self.theme.resource_path('%s.png'%name), alpha=True)
 
-        self._screen.blit(image, (x, y))
+    def get_background(self, page):
+        return self.images.get(self.theme.background_path(page))
+
+    def prefetch_neighbors(self):
+        # decode the backgrounds of the pages a swipe can lead to, before they are needed
+        pages = set((self.get_next_page(-1), self.get_next_page(1))) - set([self._cur_page])
+        self.images.prefetch([self.theme.background_path(p) for p in pages])
+
+    def render_image(self, name, x, y, surface=None):
+        image = self.load_image(name)
+        (surface or self._screen).blit(image, (x, y))
         return image
 
+    def invalidate(self):
+        # next draw_ui() will repaint the whole screen
+        self._full_redraw = True
+
+    def widget_value(self, kind, index, fn, page=None):
+        # Result of the widget handler fn(self), computed again only once one of the
+        # observable values it read changed (handlers reading none run on every call)
+        key = (self._cur_page if page is None else page, kind, index)
+        cached = self._widget_values.get(key)
+        if cached is None or not cached[1] or changed(cached[1]):
+            cached = self._widget_values[key] = track(fn, self)
+        return cached[0]
+
+    def visible_parts(self):
+        # Parts of the printer status (see polling.py) read by the widgets of the current page
+        deps = [d for (page, kind, i), (result, d) in self._widget_values.items() if page == self._cur_page]
+        if not deps:
+            return POLL_PARTS # not evaluated yet
+        reads = set(id(c) for d in deps for c, version in d)
+        printer = self.printer
+        cells = {
+                'state': [cell(printer, 'paused'), cell(printer, 'printing'), cell(printer, 'status_text')],
+                'temperature': [cell(printer, 'temperatures'), cell(self, 'printer_info'), cell(printer.history, 'version')],
+                }
+        return [part for part in POLL_PARTS if any(id(c) in reads for c in cells[part])]
+
+    def get_widget_items(self, ox=0, oy=0, page=None, kinds=WIDGET_KINDS):
+        # Evaluates the widgets of a page (the current one by default) as (key, rect) items,
+        # two items with the same key look the same on screen
+        items = []
+        if page is None:
+            page = self._cur_page
+        widgets = dict((kind, self.widgets[page][kind] if kind in kinds else ()) for kind in WIDGET_KINDS)
+        with counters.phase('eval.icons'):
+            for i, (x, y, icon) in enumerate(widgets['icons']):
+                pic = self.widget_value('icons', i, icon, page)
+                if not self.options.keep_icons_on_swipe:
+                    x += ox
+                    y += oy
+                if pic:
+                    items.append((('icon', pic, x, y), self.load_image(pic).get_rect(topleft=(x, y))))
+                else: # keep a placeholder so that items are always paired with the previous frame
+                    items.append((('icon', '', x, y), pygame.Rect(x, y, 0, 0)))
+
+        with counters.phase('eval.texts'):
+            color = tuple(self.options.default_text_color)
+            for i, text in enumerate(widgets['texts']):
+                label = self.widget_value('texts', i, text[2], page)
+                x, y = ox + text[0], oy + text[1]
+                size = self.text_renderer.size(self.font, self._font_size, label, color)
+                items.append((('text', label, x, y, color, self._font_size), pygame.Rect((x, y), size)))
+
+        with counters.phase('eval.rects'):
+            for i, rect in enumerate(widgets['rects']):
+                pos, color = self.widget_value('rects', i, rect, page)
+                pos = (pos[0] + ox, pos[1] + oy, pos[2], pos[3])
+                r = pygame.Rect(pos)
+                r.normalize()
+                items.append((('rect', pos, tuple(color)), r))
+
+        with counters.phase('eval.graphs'):
+            version = self.printer.history.version
+            for i, (pos, graph) in enumerate(widgets['graphs']):
+                curves = tuple((name, which, tuple(color)) for name, which, color in self.widget_value('graphs', i, graph, page))
+                pos = (pos[0] + ox, pos[1] + oy, pos[2], pos[3])
+                items.append((('graph', pos, curves, version), pygame.Rect(pos)))
+        return items
+
+    def draw_item(self, key, surface=None):
+        with counters.phase('draw.' + key[0]):
+            if key[0] == 'icon':
+                if key[1]:
+                    self.render_image(key[1], key[2], key[3], surface)
+            elif key[0] == 'text':
+                self.render_text(key[1], key[2], key[3], key[4], surface)
+            elif key[0] == 'rect':
+                pygame.draw.rect(surface or self._screen, key[2], key[1])
+            elif key[0] == 'graph':
+                self.render_graph(key[1], key[2], surface)
+
+    def draw_items(self, keys, surface=None):
+        # draw_item() of every key, the icons in between other items go by one Surface.blits() call
+        surface = surface or self._screen
+        icons = []
+        for key in keys + [None]:
+            if key and key[0] == 'icon':
+                if key[1]:
+                    icons.append((self.load_image(key[1]), (key[2], key[3])))
+                continue
+            if icons:
+                with counters.phase('draw.icon'):
+                    surface.blits(icons, False)
+                icons = []
+            if key:
+                self.draw_item(key, surface)
+
+    def page_snapshot(self, page):
+        # The page fully composed (background & widgets) on a surface, drawn again once one of
+        # the observables read by its widgets changed. Widgets reading none are evaluated on
+        # every call and their items compared. Without the icons if they stay during swipes.
+        kinds = WIDGET_KINDS[1:] if self.options.keep_icons_on_swipe else WIDGET_KINDS
+        cached = self._snapshots.get(page)
+        if cached is not None and not cached[2] and cached[3] == self._font_size and not changed(cached[1]):
+            return cached[0]
+        keys = [key for key, rect in self.get_widget_items(page=page, kinds=kinds)]
+        if cached is None or cached[2] != keys or cached[3] != self._font_size or changed(cached[1]):
+            with counters.phase('snapshot'):
+                surface = self.get_background(page).copy()
+                self.draw_items(keys, surface)
+            deps, volatile = self.page_dependencies(page, kinds)
+            cached = self._snapshots[page] = (surface, deps, keys if volatile else None, self._font_size)
+        return cached[0]
+
+    def page_dependencies(self, page, kinds):
+        # (observables read by the widgets of a page, True if some widgets read none)
+        deps, volatile = [], False
+        for (p, kind, i), (result, d) in self._widget_values.items():
+            if p == page and kind in kinds:
+                deps.extend(d)
+                volatile = volatile or not d
+        if 'graphs' in kinds and self.widgets[page]['graphs']:
+            version = cell(self.printer.history, 'version')
+            deps.append((version, version[1]))
+        return deps, volatile
+
+    def draw_swipe(self, items, ox, oy):
+        # Swipe frame: the snapshots of the current page & of the one coming in
+        direction = 1 if ox < 0 or oy < 0 else -1
+        self._screen.blit(self.page_snapshot(self._cur_page), (ox, oy))
+        coming = (ox + direction*self.size[0] if ox else 0, oy + direction*self.size[1] if oy else 0)
+        self._screen.blit(self.page_snapshot(self.get_next_page(direction)), coming)
+        if self.options.keep_icons_on_swipe:
+            self.draw_items([key for key, rect in items if key[0] == 'icon'])
+
+    def render_graph(self, pos, curves, surface=None):
+        # curves: (series name, 'actual' or 'target', color) read from the printer history,
+        # one vertical min-max segment per pixel column, scaled to the drawn values
+        x, y, w, h = pos
+        history = self.printer.history
+        columns = [(history.columns(name, w, which), color) for name, which, color in curves]
+        values = [v for cols, color in columns for col in cols for v in col]
+        if not values:
+            return
+        low, high = min(values), max(values)
+        if high - low < GRAPH_MIN_SPAN:
+            low = (low + high - GRAPH_MIN_SPAN) / 2.0
+            high = low + GRAPH_MIN_SPAN
+        scale = (h - 1) / float(high - low)
+        bottom = y + h - 1
+        surface = surface or self._screen
+        for cols, color in columns:
+            prev = None
+            for i, (vmin, vmax) in enumerate(cols):
+                top, base = bottom - int((vmax - low)*scale), bottom - int((vmin - low)*scale)
+                if prev is not None: # joins the previous column
+                    top, base = min(top, prev), max(base, prev)
+                pygame.draw.line(surface, color, (x + w - len(cols) + i, top), (x + w - len(cols) + i, base))
+                prev = (top + base) // 2
+
+    def toggle_hud(self):
+        self.hud = not self.hud
+        counters.enabled = bool(self.hud or PERF_DUMP)
+        self._hud = None
+        self.invalidate()
+
+    def get_hud(self):
+        # (surface, rect) of the performance overlay, refreshed every HUD_REFRESH seconds
+        if not self.hud:
+            return None
+        if self._hud is None or time.time() - self._hud_time > HUD_REFRESH:
+            font = self._hud_font = getattr(self, '_hud_font', None) or pygame.font.Font(self.theme.resource_path('impact.ttf'), 12)
+            lines = counters.report_lines() or ['collecting...']
+            height = font.get_linesize()
+            surface = pygame.Surface((max(font.size(l)[0] for l in lines) + 8, height*len(lines) + 4))
+            surface.set_alpha(200)
+            for i, line in enumerate(lines):
+                surface.blit(font.render(line, True, (255, 255, 0)), (4, 2 + i*height))
+            self._hud = (surface, surface.get_rect(topleft=(0, 0)))
+            self._hud_time = time.time()
+        return self._hud
+
+    def get_feedback_circle(self):
+        # (color, center, radius) of the event feedback circle, or None
+        if self.event_queue > 10:
+            color = (200, 78, 50, 0.1) if self.last_action_failed else (111, 199, 232, 0.1)
+            return (color, self.click_grab_start, min(70, int(self.event_queue)))
+
+    def present(self, rects=None):
+        # Pushes the frame to the display, only the given areas if any
+        with counters.phase('present'):
+            if self.output:
+                self.output.write(self._screen, rects)
+            elif rects is None:
+                pygame.display.flip()
+            elif rects:
+                pygame.display.update(rects)
+
     def draw_ui(self):
-        t0 = time.time()
+        ox, oy = self.get_swipe_offset()
 
+        if self._popups:
+            items = []
+        elif ox or oy: # the pages come from snapshots, only the icons staying in place are live
+            items = self.get_widget_items(kinds=('icons',)) if self.options.keep_icons_on_swipe else []
+        else:
+            items = self.get_widget_items()
+        feedback = self.get_feedback_circle()
+        hud = self.get_hud()
+        frame_state = (self._cur_page, bool(self._popups), ox, oy)
+
+        # Widget level damage tracking: only repaint what changed since the last frame
+        # when staying on the same still page, full frame otherwise
+        full = self._full_redraw or DEBUG_UI or self._popups or ox or oy or frame_state != self._drawn_state \
+                or len(items) != len(self._drawn_items)
+
+        if full:
+            self.draw_frame(items, feedback, ox, oy)
+            if hud:
+                self._screen.blit(*hud)
+            self.present()
+            if self._drawn_state is None or self._drawn_state[0] != self._cur_page:
+                self.prefetch_neighbors()
+                self.io.set_visible(self.visible_parts())
+        else:
+            damaged = []
+            for (key, rect), (old_key, old_rect) in zip(items, self._drawn_items):
+                if key != old_key:
+                    damaged.append(old_rect)
+                    damaged.append(rect)
+            if feedback != self._drawn_feedback:
+                for circle in (feedback, self._drawn_feedback):
+                    if circle:
+                        damaged.append(circle_rect(circle))
+            if hud is not self._drawn_hud:
+                for overlay in (hud, self._drawn_hud):
+                    if overlay:
+                        damaged.append(overlay[1])
+            rects = [r.clip(self._screen.get_rect()) for r in merge_rects(damaged)]
+            background = self.get_background(self._cur_page)
+            for area in rects:
+                self._screen.set_clip(area)
+                self._screen.blit(background, area.topleft, area)
+                for key, rect in items:
+                    if rect.colliderect(area):
+                        self.draw_item(key)
+                if feedback and circle_rect(feedback).colliderect(area):
+                    pygame.draw.circle(self._screen, *feedback)
+                if hud and hud[1].colliderect(area):
+                    self._screen.blit(*hud)
+            self._screen.set_clip(None)
+            self.present(rects)
+
+        self._full_redraw = False
+        self._drawn_state = frame_state
+        self._drawn_items = items
+        self._drawn_feedback = feedback
+        self._drawn_hud = hud
+
+    def draw_frame(self, items, feedback, ox, oy):
         # Popups
 
         special_mode = False
         if self._popups:
             pygame.draw.rect(self._screen, (100, 100, 120), (0, 0, self.size[0], self.size[1]))
 
-            options = self._popups[0]['captions']
-            sz = int(self.size[1]/len(options))
-            self.set_font(sz-20)
-            for i, label in enumerate(options):
-                self.render_text(label, 20, i*sz)
+            popup = self._popups[0]
+            options = popup['captions']
+            if popup.get('image'):
+                self._screen.blit(popup['image'], (0, 0))
+            if popup.get('rects'):
+                self.set_font(popup.get('font_size', 20))
+                for label, r in zip(options, popup['rects']):
+                    self.render_text(label, r[0] + 20, (r[1] + r[3] - self._font_size) // 2)
+            else:
+                sz = int(self.size[1]/len(options))
+                self.set_font(sz-20)
+                for i, label in enumerate(options):
+                    self.render_text(label, 20, i*sz)
 
             special_mode = True
 
-        if not special_mode and self.grab_mode:
-            if self.options.vertical_swipe:
-                ox = 0
-                oy = self.click_grab_cur[1] - self.click_grab_start[1]
-            else:
-                ox = self.click_grab_cur[0] - self.click_grab_start[0]
-                oy = 0
-        else:
-            ox = 0
-            oy = 0
-
         if not special_mode:
-            if ox > 0:
-                self._screen.blit(self._backgrounds[self.get_next_page(-1)], (ox-self.size[0], 0))
-            elif ox < 0:
-                self._screen.blit(self._backgrounds[self.get_next_page(1)], (ox+self.size[0], 0))
-
-            if oy > 0:
-                self._screen.blit(self._backgrounds[self.get_next_page(-1)], (0, oy-self.size[1]))
-            elif oy < 0:
-                self._screen.blit(self._backgrounds[self.get_next_page(1)], (0, oy+self.size[1]))
-
-            self._screen.blit(self._backgrounds[self._cur_page], (ox, oy))
-
-            for x, y, icon in self.widgets[self._cur_page]['icons']:
-                pic = icon(self)
-                if pic:
-                    if self.options.keep_icons_on_swipe:
-                        self.render_image(pic, x, y)
-                    else:
-                        self.render_image(pic, ox+x, oy+y)
-
-            for text in self.widgets[self._cur_page]['texts']:
-                self.render_text(text[2](self), ox + text[0], oy + text[1])
-
-            for rect in self.widgets[self._cur_page]['rects']:
-                pos, color = rect(self)
-                pos = list(pos)
-                pos[0] += ox
-                pos[1] += oy
-                pygame.draw.rect(self._screen, color, pos)
+            if ox or oy:
+                self.draw_swipe(items, ox, oy)
+            else:
+                self._screen.blit(self.get_background(self._cur_page), (0, 0))
+                self.draw_items([key for key, rect in items])
 
         # Event feedback
-        if self.event_queue:
-            if self.event_queue > 10:
-                pygame.draw.circle(self._screen, (200, 78, 50, 0.1) if self.last_action_failed else (111, 199, 232, 0.1), self.click_grab_start, min(70, int(self.event_queue)))
+        if feedback:
+            pygame.draw.circle(self._screen, *feedback)
 
         # Debugging overlay
         if DEBUG_UI and not (self.grab_mode or special_mode):
@@ -429,38 +1037,74 @@ class App: # View
             pygame.draw.rect(self._screen, (0, 0, 0), (0, self.mouse_pos[1], self.size[0], 1))
             pygame.draw.rect(self._screen, (0, 0, 0), (self.mouse_pos[0], 0, 1, self.size[1]))
 
-        pygame.display.flip()
-        self._ui_draw_time = (self._ui_draw_time + (time.time()-t0))/2.0
-
     def quit(self):
         self._running = False
 
     def run(self):
-        self._popups = []
-        self._pending_actions = []
+        self.io.start()
+        if self.io.push:
+            self.io.push.start()
+        if self.farm:
+            self.farm.start()
+        frame_clock = pygame.time.Clock()
+        pending = []
         while( self._running ):
+            t0 = clock()
             self.event_processed = False
-            for event in pygame.event.get():
-                self.process_event(event)
-            self.update()
-            if self.dirty or self.event_processed or self.event_queue or self.grab_mode or DEBUG_UI=='repaint':
-                self.draw_ui()
+            with counters.phase('events'):
+                for event in coalesce_motion(pending + pygame.event.get()):
+                    self.process_event(event)
+            pending = []
+            with counters.phase('update'):
+                self.update()
+                self.animate()
+            counters.maybe_dump(PERF_DUMP, PERF_DUMP_INTERVAL)
+            if self.dirty or self.event_processed or self.event_queue or self.grab_mode or self._swipe or DEBUG_UI=='repaint':
+                with counters.phase('draw'), tracer.span('draw_ui'):
+                    self.draw_ui()
+                tracer.frame_drawn()
                 self.dirty = False
+                counters.add('frame', clock() - t0)
+                elapsed = frame_clock.tick(TARGET_FPS)/1000.0 # frame pacing
                 if self.event_queue:
-                    self.event_queue = max(0, self.event_queue - (self._ui_draw_time*100))
+                    self.event_queue = max(0, self.event_queue - elapsed*FEEDBACK_DECAY)
             else:
-                pygame.time.wait(200)
+                # sleep until some input or I/O completion (EVENT_IO) shows up
+                event = pygame.event.wait(IDLE_TIMEOUT)
+                if event.type != pygame.NOEVENT:
+                    pending.append(event)
+                frame_clock.tick()
+        if self.farm:
+            self.farm.stop()
+        if self.io.push:
+            self.io.push.stop()
+        self.io.stop()
+        for engine in self.engines: # the sessions are closed below
+            engine.join(1.0)
+            if engine.push:
+                engine.push.join(1.0)
+        for printer in self.printers:
+            printer.close()
+        if self.output:
+            self.output.close()
+        if TRACE:
+            tracer.export(TRACE)
         pygame.quit()
 
 if __name__ == "__main__" :
-    fp = getResourcesPath('layout.py')
-    # TODO: cleaner theme loading
-    exec(open(fp).read())
-    for widget in widgets:
-        for item in 'rects texts icons'.split():
-            if item not in widget:
-                widget[item] = []
-    theApp = App(actions = actions, widgets = widgets)
-    theApp.options = UIOptions(options)
+    try:
+        theme = load_theme(THEME)
+    except ThemeError as e:
+        print('ERROR: cannot load theme "%s": %s'%(THEME, e))
+        sys.exit(-1)
+    try:
+        printers = load_farm(FARM) if FARM else None
+    except FarmError as e:
+        print('ERROR: cannot load the farm: %s'%e)
+        sys.exit(-1)
+    try:
+        theApp = App(theme, printers)
+    except FramebufferError as e:
+        print('ERROR: cannot use the framebuffer: %s'%e)
+        sys.exit(-1)
     theApp.run()
-
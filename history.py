@@ -0,0 +1,79 @@
+import threading
+from array import array
+
+from observable import Observable
+
+TEMP_HISTORY_SIZE = 3600 # samples kept, one hour at the default polling interval
+TEMP_SERIES = ('extruder', 'bed')
+
+
+class TemperatureHistory:
+    # Ring buffer of the actual & target temperatures, one typed array per series:
+    # the memory is allocated once, whatever the length of the print.
+    # Written by the I/O or push thread, read by the renderer.
+
+    version = Observable(0) # bumped on every new sample
+
+    def __init__(self, size=TEMP_HISTORY_SIZE):
+        self.size = size
+        self.count = 0
+        self.head = 0 # index of the next write
+        self.times = array('d', [0.0]) * size
+        self.series = {}
+        for name in TEMP_SERIES:
+            self.series[(name, 'actual')] = array('f', [0.0]) * size
+            self.series[(name, 'target')] = array('f', [0.0]) * size
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.count
+
+    def append(self, when, temperatures):
+        # temperatures: {name: (actual, target)}, as PrintCommands.temperatures
+        # Samples older than the last one are ignored (the push "history" message is sent
+        # again on every reconnection)
+        with self._lock:
+            if self.count and when <= self.times[self.head-1]:
+                return False
+            i = self.head
+            self.times[i] = when
+            for name in TEMP_SERIES:
+                actual, target = temperatures.get(name, (0, 0))
+                self.series[(name, 'actual')][i] = actual
+                self.series[(name, 'target')][i] = target or 0
+            self.head = (i + 1) % self.size
+            self.count = min(self.count + 1, self.size)
+            self.version += 1
+        return True
+
+    def clear(self):
+        with self._lock:
+            self.count = self.head = 0
+            self.version += 1
+
+    def _ordered(self, data):
+        # oldest sample first
+        if self.count < self.size:
+            return data[:self.count]
+        return data[self.head:] + data[:self.head]
+
+    def samples(self, name, which='actual'):
+        with self._lock:
+            return self._ordered(self.series[(name, which)])
+
+    def columns(self, name, width, which='actual'):
+        # Downsamples the series to `width` pixel columns: list of (min, max), keeping the
+        # peaks a plain decimation would miss (PID oscillations). The min() & max() of the
+        # array slices run in C.
+        data = self.samples(name, which)
+        n = len(data)
+        if n <= width:
+            return [(v, v) for v in data]
+        result = []
+        lo = 0
+        for col in range(1, width+1):
+            hi = col * n // width
+            chunk = data[lo:hi]
+            result.append((min(chunk), max(chunk)))
+            lo = hi
+        return result
@@ -0,0 +1,90 @@
+import inspect
+
+HIT_CELL_SIZE = 16 # pixels, side of the lookup grid cells
+
+
+def _wants_position(fn):
+    # True if the handler takes the (x, y) click position
+    try:
+        params = inspect.signature(fn).parameters.values()
+    except (TypeError, ValueError):
+        return False
+    positional = 0
+    for p in params:
+        if p.kind == p.VAR_POSITIONAL:
+            return True
+        if p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD):
+            positional += 1
+    return positional >= 2
+
+
+class Action:
+    # A theme action with its handler resolved once, at load time
+    __slots__ = ('name', 'rect', 'fn', 'wants_position')
+
+    def __init__(self, name, rect, fn):
+        self.name = name
+        self.rect = rect
+        self.fn = fn # None for "no op" actions
+        self.wants_position = bool(fn) and _wants_position(fn)
+
+    def contains(self, x, y):
+        r = self.rect
+        return x > r[0] and x < r[2] and y > r[1] and y < r[3]
+
+    def __call__(self, x, y):
+        if self.wants_position:
+            return self.fn(x, y)
+        return self.fn()
+
+
+class HitMap:
+    # Compiled actions of a page: a grid of cells over the screen, each one listing the
+    # actions covering it in declaration order, so a click only checks a couple of rects.
+    #  actions: {(x1, y1, x2, y2): name}
+    #  resolve: callable(name) returning the handler or None if unknown
+
+    def __init__(self, actions, resolve, size, cell=HIT_CELL_SIZE):
+        self.cell = cell
+        self.cols = int(size[0] + cell - 1) // cell
+        self.rows = int(size[1] + cell - 1) // cell
+        self.grid = [() for _ in range(self.cols * self.rows)]
+        self.actions = []
+        self.unknown = []
+
+        for rect, name in actions.items():
+            if name:
+                fn = resolve(name)
+                if fn is None:
+                    self.unknown.append(name)
+                    continue
+            else:
+                fn = None
+            self.actions.append(Action(name, rect, fn))
+
+        for action in self.actions:
+            x1, y1, x2, y2 = action.rect
+            for row in range(max(0, int(y1) // cell), min(self.rows, int(y2) // cell + 1)):
+                for col in range(max(0, int(x1) // cell), min(self.cols, int(x2) // cell + 1)):
+                    i = row * self.cols + col
+                    self.grid[i] = self.grid[i] + (action,)
+
+    @property
+    def overlaps(self):
+        # pairs of action names whose areas intersect (the first declared one wins)
+        found = []
+        for i, a in enumerate(self.actions):
+            for b in self.actions[i+1:]:
+                if a.rect[0] < b.rect[2] and b.rect[0] < a.rect[2] and a.rect[1] < b.rect[3] and b.rect[1] < a.rect[3]:
+                    found.append((a.name, b.name))
+        return found
+
+    def find(self, x, y):
+        col = int(x) // self.cell
+        row = int(y) // self.cell
+        if col < 0 or row < 0 or col >= self.cols or row >= self.rows:
+            return None
+        for action in self.grid[row * self.cols + col]:
+            if action.contains(x, y):
+                return action
+        return None
@@ -0,0 +1,97 @@
+import threading
+from collections import OrderedDict
+
+try:
+    import queue
+except ImportError: # python2
+    import Queue as queue
+
+import pygame
+
+IMAGE_CACHE_BUDGET = 16*1024*1024 # bytes of decoded surfaces kept in memory
+PREFETCH_MAX = 4 # max number of prefetched images waiting to be used
+
+
+def surface_bytes(surface):
+    return surface.get_pitch() * surface.get_height()
+
+
+class ImageCache:
+    # Loads images on demand, keeping the converted surfaces in a LRU bounded in bytes.
+    # prefetch() decodes files in a background thread, the (cheap) conversion to the
+    # display format is done by the next get() in the calling thread.
+
+    def __init__(self, budget=IMAGE_CACHE_BUDGET):
+        self.budget = budget
+        self.used = 0
+        self._cache = OrderedDict() # (path, alpha): surface
+        self._decoded = OrderedDict() # path: surface loaded by the prefetch thread
+        self._pinned = {} # (path, alpha): surface always available (precompiled theme, see atlas.py)
+        self._lock = threading.Lock()
+        self._queue = None
+
+    def __len__(self):
+        return len(self._cache)
+
+    def get(self, path, alpha=False):
+        key = (path, alpha)
+        image = self._pinned.get(key)
+        if image is not None:
+            return image
+        with self._lock:
+            image = self._cache.get(key)
+            if image is not None:
+                self._cache.move_to_end(key)
+                return image
+            raw = self._decoded.pop(path, None)
+
+        if raw is None:
+            raw = pygame.image.load(path)
+        image = raw.convert_alpha() if alpha else raw.convert()
+
+        with self._lock:
+            self._cache[key] = image
+            self.used += surface_bytes(image)
+            while self.used > self.budget and len(self._cache) > 1:
+                old_key, old = self._cache.popitem(last=False)
+                self.used -= surface_bytes(old)
+        return image
+
+    def prefetch(self, paths):
+        if self._queue is None:
+            self._queue = queue.Queue()
+            t = threading.Thread(target=self._prefetch_loop, name='image-prefetch')
+            t.daemon = True
+            t.start()
+        for path in paths:
+            self._queue.put(path)
+
+    def _is_known(self, path):
+        with self._lock:
+            return path in self._decoded or (path, False) in self._cache or (path, True) in self._cache \
+                    or (path, False) in self._pinned or (path, True) in self._pinned
+
+    def pin(self, surfaces):
+        # {(path, alpha): surface} kept out of the LRU & its budget
+        self._pinned.update(surfaces)
+
+    def _prefetch_loop(self):
+        while True:
+            path = self._queue.get()
+            if self._is_known(path):
+                continue
+            try:
+                raw = pygame.image.load(path)
+            except Exception as e:
+                print("Can't prefetch %s: %s"%(path, e))
+                continue
+            with self._lock:
+                self._decoded[path] = raw
+                while len(self._decoded) > PREFETCH_MAX:
+                    self._decoded.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._decoded.clear()
+            self.used = 0
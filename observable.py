@@ -0,0 +1,67 @@
+import threading
+
+
+class _Tracker(threading.local):
+    reads = None # list of (cell, version) while tracking, in the current thread
+
+_tracker = _Tracker()
+
+
+class Observable:
+    # Attribute descriptor keeping a version number, bumped on every change of the value.
+    # Reads are recorded by track(), so that a computation can tell when it is outdated.
+
+    def __init__(self, default=None):
+        self.default = default
+        self.slot = None
+
+    def __set_name__(self, owner, name):
+        self.slot = '_observed_' + name
+
+    def _cell(self, obj):
+        cell = obj.__dict__.get(self.slot)
+        if cell is None:
+            cell = obj.__dict__[self.slot] = [self.default, 0]
+        return cell
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        cell = self._cell(obj)
+        reads = _tracker.reads
+        if reads is not None:
+            reads.append((cell, cell[1]))
+        return cell[0]
+
+    def __set__(self, obj, value):
+        cell = self._cell(obj)
+        if value != cell[0] or type(value) is not type(cell[0]):
+            cell[0] = value
+            cell[1] += 1
+
+    def version(self, obj):
+        return self._cell(obj)[1]
+
+
+def cell(obj, name):
+    # the [value, version] cell behind the observable attribute `name` of obj, to identify it
+    # among the dependencies returned by track()
+    return getattr(type(obj), name)._cell(obj)
+
+
+def track(fn, *args):
+    # Calls fn(*args), returns its result and the (cell, version) of the observables it read
+    previous = _tracker.reads
+    reads = _tracker.reads = []
+    try:
+        result = fn(*args)
+    finally:
+        _tracker.reads = previous
+    return result, reads
+
+
+def changed(dependencies):
+    for cell, version in dependencies:
+        if cell[1] != version:
+            return True
+    return False
@@ -0,0 +1,284 @@
+import os
+import json
+import time
+import bisect
+import itertools
+import threading
+from collections import deque
+
+PERF_SAMPLES = 300 # samples kept per timer, for the percentiles
+TRACE_MAX_EVENTS = 100000 # oldest trace events are forgotten past this count
+HTTP_BUCKETS = (0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0) # latency histogram limits, in seconds
+
+clock = getattr(time, 'perf_counter', time.time)
+
+
+class Timer:
+    # Counts & sums every sample, keeps the last PERF_SAMPLES ones for the percentiles
+
+    def __init__(self):
+        self.samples = deque(maxlen=PERF_SAMPLES)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+
+    def percentile(self, p):
+        samples = sorted(self.samples)
+        if not samples:
+            return 0.0
+        return samples[min(len(samples)-1, int(len(samples)*p/100.0))]
+
+    def summary(self):
+        samples = sorted(self.samples)
+        if not samples:
+            return dict(count=self.count)
+        pick = lambda p: samples[min(len(samples)-1, int(len(samples)*p/100.0))]
+        return dict(count=self.count, avg=sum(samples)/len(samples),
+                p50=pick(50), p90=pick(90), p99=pick(99), max=samples[-1])
+
+
+class Histogram(Timer):
+    # Timer also counting the samples in fixed latency buckets
+
+    def __init__(self, buckets=HTTP_BUCKETS):
+        Timer.__init__(self)
+        self.buckets = buckets
+        self.counts = [0]*(len(buckets)+1)
+        self.errors = 0
+
+    def add(self, seconds, ok=True):
+        Timer.add(self, seconds)
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        if not ok:
+            self.errors += 1
+
+    def summary(self):
+        d = Timer.summary(self)
+        labels = ['<=%gms'%(b*1000) for b in self.buckets] + ['>%gms'%(self.buckets[-1]*1000)]
+        d['histogram'] = dict(zip(labels, self.counts))
+        d['errors'] = self.errors
+        return d
+
+
+class _Phase:
+    __slots__ = ('counters', 'name', 't0')
+
+    def __init__(self, counters, name):
+        self.counters = counters
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = clock()
+        return self
+
+    def __exit__(self, *exc):
+        self.counters.add(self.name, clock() - self.t0)
+
+
+class _NoPhase:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+_NO_PHASE = _NoPhase()
+
+
+class PerfCounters:
+    # Named timers (phases of the main loop, frames) and per endpoint HTTP latency histograms.
+    # Nothing is recorded unless `enabled` is set.
+    # Samples come from several threads (the HTTP ones from the I/O thread): they are added
+    # & read under a lock.
+
+    def __init__(self):
+        self.enabled = False
+        self.timers = {}
+        self.http_latency = {}
+        self.last_dump = 0
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self.timers = {}
+            self.http_latency = {}
+
+    def add(self, name, seconds):
+        if self.enabled:
+            with self._lock:
+                timer = self.timers.get(name)
+                if timer is None:
+                    timer = self.timers[name] = Timer()
+                timer.add(seconds)
+
+    def phase(self, name):
+        # usage: with counters.phase('update'): ...
+        return _Phase(self, name) if self.enabled else _NO_PHASE
+
+    def http(self, endpoint, seconds, ok=True):
+        if self.enabled:
+            with self._lock:
+                hist = self.http_latency.get(endpoint)
+                if hist is None:
+                    hist = self.http_latency[endpoint] = Histogram()
+                hist.add(seconds, ok)
+
+    def summary(self):
+        with self._lock:
+            return dict(
+                    time = time.time(),
+                    timers = dict((name, t.summary()) for name, t in self.timers.items()),
+                    http = dict((name, h.summary()) for name, h in self.http_latency.items()),
+                    )
+
+    def dump(self, path):
+        with open(path, 'a') as f:
+            f.write(json.dumps(self.summary(), sort_keys=True) + '\n')
+        self.last_dump = time.time()
+
+    def maybe_dump(self, path, interval):
+        # appends a summary line to `path` every `interval` seconds
+        if path and self.enabled and time.time() - self.last_dump >= interval:
+            self.dump(path)
+
+    def report_lines(self):
+        # short human readable summary, used by the HUD
+        with self._lock:
+            return self._report_lines()
+
+    def _report_lines(self):
+        lines = []
+        frame = self.timers.get('frame')
+        if frame and frame.samples:
+            avg = sum(frame.samples)/len(frame.samples)
+            lines.append('frame %.1fms p50 %.1f p90 %.1f p99 %.1f (%.0f fps)'%(
+                avg*1000, frame.percentile(50)*1000, frame.percentile(90)*1000, frame.percentile(99)*1000,
+                1.0/avg if avg else 0))
+        for name in sorted(self.timers):
+            t = self.timers[name]
+            if name != 'frame' and t.samples:
+                lines.append('%s %.2fms p90 %.2f'%(name, sum(t.samples)/len(t.samples)*1000, t.percentile(90)*1000))
+        for name in sorted(self.http_latency):
+            h = self.http_latency[name]
+            lines.append('%s %.0fms p90 %.0f n=%d err=%d'%(name, h.percentile(50)*1000, h.percentile(90)*1000, h.count, h.errors))
+        return lines
+
+
+class _Span:
+    __slots__ = ('tracer', 'name', 'cat', 'args', 't0')
+
+    def __init__(self, tracer, name, cat, args):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.t0 = clock()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.complete(self.name, self.cat, self.t0, clock(), **self.args)
+
+
+class Tracer:
+    # Records spans in the Chrome trace event format (chrome://tracing, Perfetto).
+    # A touch opens an asynchronous "touch" span; the requests submitted while its id is the
+    # current trace context (a thread local, handed over to the I/O thread with the request)
+    # are tied to it, and it is closed by the first frame drawn once the touch is released
+    # and all its requests got their results.
+
+    def __init__(self):
+        self.enabled = False
+        self.events = deque(maxlen=TRACE_MAX_EVENTS)
+        self._ids = itertools.count(1)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._touches = {} # id: [start time, pending requests, released]
+        self._threads = {}
+
+    def _ts(self, t):
+        return int(t * 1000000)
+
+    def _thread(self):
+        t = threading.current_thread()
+        if t.ident not in self._threads:
+            with self._lock:
+                self._threads[t.ident] = t.name
+        return t.ident
+
+    def current(self):
+        return getattr(self._local, 'trace', None)
+
+    def set_current(self, trace):
+        self._local.trace = trace
+
+    def span(self, name, cat='ui', **args):
+        # usage: with tracer.span('run_action_at'): ...
+        if not self.enabled:
+            return _NO_PHASE
+        trace = self.current()
+        if trace is not None:
+            args['touch'] = trace
+        return _Span(self, name, cat, args)
+
+    def complete(self, name, cat, start, end, **args):
+        self.events.append(dict(name=name, cat=cat, ph='X', ts=self._ts(start), dur=self._ts(end-start),
+            pid=os.getpid(), tid=self._thread(), args=args))
+
+    def start_touch(self, **args):
+        # opens a touch span and makes it the current context, returns its id
+        if not self.enabled:
+            return None
+        trace = next(self._ids)
+        with self._lock:
+            self._touches[trace] = [clock(), 0, False]
+        self.events.append(dict(name='touch', cat='touch', ph='b', id=trace, ts=self._ts(clock()),
+            pid=os.getpid(), tid=self._thread(), args=args))
+        self.set_current(trace)
+        return trace
+
+    def release_touch(self, trace):
+        with self._lock:
+            if trace in self._touches:
+                self._touches[trace][2] = True
+
+    def request_submitted(self, trace):
+        with self._lock:
+            if trace in self._touches:
+                self._touches[trace][1] += 1
+
+    def request_done(self, trace):
+        with self._lock:
+            if trace in self._touches:
+                self._touches[trace][1] -= 1
+
+    def frame_drawn(self):
+        # closes the touches whose results are now on screen
+        if not self._touches:
+            return
+        now = clock()
+        tid = self._thread()
+        with self._lock:
+            done = [t for t, (start, pending, released) in self._touches.items() if released and pending <= 0]
+            for trace in done:
+                start = self._touches.pop(trace)[0]
+                self.events.append(dict(name='touch', cat='touch', ph='e', id=trace, ts=self._ts(now),
+                    pid=os.getpid(), tid=tid, args={'latency_ms': (now - start)*1000}))
+
+    def export(self, path):
+        events = list(self.events)
+        with self._lock:
+            threads = list(self._threads.items())
+        for ident, name in threads:
+            events.append(dict(name='thread_name', ph='M', pid=os.getpid(), tid=ident, args={'name': name}))
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+counters = PerfCounters() # process wide instances
+tracer = Tracer()
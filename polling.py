@@ -0,0 +1,80 @@
+import time
+
+POLL_PARTS = ('state', 'temperature') # parts of api/printer, fetched apart with its "exclude" option
+
+# multipliers of the polling interval, per printer activity & part
+POLL_RATES = {
+        'heating': {'state': 1.0, 'temperature': 0.5},
+        'printing': {'state': 1.0, 'temperature': 1.0},
+        'idle': {'state': 2.5, 'temperature': 2.5},
+        }
+POLL_HIDDEN_RATE = 3.0 # extra multiplier for the parts the visible page doesn't show
+POLL_OFFLINE_MAX = 60.0 # seconds, limit of the exponential backoff while OctoPrint is unreachable
+POLL_MERGE = 0.25 # a part due within this fraction of its period is fetched along with a due one
+HEATING_MARGIN = 3.0 # degrees, a heater further than this from its target is heating
+
+
+def activity(status):
+    # 'offline', 'heating', 'printing' or 'idle', from a PrinterStatus
+    if status.offline:
+        return 'offline'
+    for actual, target in status.temperatures.values():
+        if target and abs(target - actual) > HEATING_MARGIN:
+            return 'heating'
+    if status.printing or status.paused:
+        return 'printing'
+    return 'idle'
+
+
+class PollScheduler:
+    # Decides when to poll each part of the printer status: faster while heating, slower when
+    # idle or when the visible page doesn't show it, backing off exponentially while offline.
+
+    def __init__(self, interval=2.0, rates=POLL_RATES):
+        self.interval = interval
+        self.rates = rates
+        self.visible = set(POLL_PARTS) # parts read by the widgets of the visible page
+        self.activity = 'idle'
+        self.backoff = 0
+        self.next_times = dict((part, 0) for part in POLL_PARTS) # part: next poll time
+
+    def period(self, part):
+        if self.activity == 'offline':
+            return self.backoff
+        period = self.interval * self.rates[self.activity][part]
+        if part not in self.visible:
+            period *= POLL_HIDDEN_RATE
+        return period
+
+    def set_visible(self, parts):
+        parts = set(parts)
+        if parts != self.visible:
+            shown = parts - self.visible
+            self.visible = parts
+            for part in shown: # just became visible: refresh it soon
+                self.next_times[part] = min(self.next_times[part], time.time())
+
+    def next_poll(self):
+        return min(self.next_times.values())
+
+    def due(self, now=None):
+        # parts to fetch now (all of them while offline: a single probe)
+        now = time.time() if now is None else now
+        if self.next_poll() > now:
+            return []
+        if self.activity == 'offline':
+            return list(POLL_PARTS)
+        return [part for part in POLL_PARTS if self.next_times[part] - now <= self.period(part) * POLL_MERGE]
+
+    def polled(self, parts, status=None, now=None):
+        # reschedules `parts`, according to the status they returned (if any)
+        now = time.time() if now is None else now
+        if status is not None:
+            self.activity = activity(status)
+            if self.activity == 'offline':
+                self.backoff = min(POLL_OFFLINE_MAX, self.backoff * 2 or self.interval)
+                parts = POLL_PARTS
+            else:
+                self.backoff = 0
+        for part in parts:
+            self.next_times[part] = now + self.period(part)
@@ -0,0 +1,274 @@
+import os
+import re
+import math
+import time
+import mmap
+import hashlib
+from array import array
+
+import pygame
+
+NAN = float('nan')
+
+PREVIEW_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'pgui4o', 'gcode') # layer indexes & downloads
+INDEX_VERSION = 2 # cached indexes of another version are built again
+DOWNLOADS_BUDGET = int(os.getenv('PREVIEW_CACHE_MB', 512))*1024*1024 # downloaded G-code kept, least recently used go first
+PREVIEW_BED_SIZE = (220, 220) # mm, X & Y area shown by the preview
+PREVIEW_COLORS = {'extrusion': (255, 140, 40), 'travel': (70, 70, 90), 'background': (20, 20, 30)}
+
+# Scanned by the re module straight from the memory mapped file, the Python loop
+# only sees the Z moves
+_Z_MOVE = re.compile(br'^G[01][ \t][^;\n]*?Z(-?[0-9.]+)|^(G9[01])(?![0-9])', re.M) # and the positioning mode
+_LAST_X = re.compile(br'^G[0-3][ \t][^;\n]*?X(-?[0-9.]+)', re.M)
+_LAST_Y = re.compile(br'^G[0-3][ \t][^;\n]*?Y(-?[0-9.]+)', re.M)
+_LAST_E = re.compile(br'^(?:G[0-3]|G92)[ \t][^;\n]*?E(-?[0-9.]+)', re.M)
+_LOOKBEHIND = 4096 # bytes searched backwards for the position at the start of a layer, doubled until found
+_EXTRUSION = re.compile(br'^G1[ \t][^;\n]*?[XY]-?[0-9.][^;\n]*?E[0-9.]|^G1[ \t][^;\n]*?E[0-9.][^;\n]*?[XY]-?[0-9.]', re.M)
+_COMMAND = re.compile(br'^(G[0-3]|G9[012]|M8[23])(?![0-9])([^;\n]*)', re.M)
+_WORD = re.compile(br'([XYE])(-?[0-9.]+)')
+
+
+class LayerIndex:
+    # Where the layers of a G-code file are: layer i is printed at heights[i] by the
+    # bytes offsets[i] to offsets[i+1] (or the end of the file) of the file.
+    # A layer starts at the Z move followed by the first extrusion at a new height,
+    # so the Z hops don't count. starts[i] is the (X, Y, E) position the layer starts from
+    # (nan when unknown).
+
+    def __init__(self, path, size, offsets, heights, relative_e=False, starts=None):
+        self.path = path
+        self.size = size
+        self.offsets = offsets # array('d') of byte offsets
+        self.heights = heights # array('d') of Z, in mm
+        self.relative_e = relative_e # M83 before the first layer
+        self.starts = starts or (array('d', [NAN]*len(offsets)), array('d', [NAN]*len(offsets)), array('d', [NAN]*len(offsets)))
+
+    def start(self, layer):
+        return tuple(None if math.isnan(values[layer]) else values[layer] for values in self.starts)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def span(self, layer):
+        end = self.offsets[layer+1] if layer+1 < len(self.offsets) else self.size
+        return int(self.offsets[layer]), int(end)
+
+    def read(self, layer):
+        # bytes of a single layer, the rest of the file stays on disk
+        start, end = self.span(layer)
+        with open(self.path, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                return data[start:end]
+            finally:
+                data.close()
+
+
+def _last_value(pattern, data, end, start=0):
+    # value of the last match of pattern in data[start:end], searched backwards by growing windows
+    window = _LOOKBEHIND
+    while True:
+        begin = max(start, end - window)
+        if begin > start: # start on a line, the patterns are anchored
+            begin = data.find(b'\n', begin, end) + 1 or end
+        last = None
+        for last in pattern.finditer(data, begin, end):
+            pass
+        if last is not None:
+            try:
+                return float(last.group(1))
+            except ValueError:
+                return NAN
+        if end - window <= start:
+            return NAN
+        window *= 2
+
+
+def _last_line(data, prefix, end):
+    # offset of the last line of data[:end] starting with prefix, -1 if none
+    found = data.rfind(b'\n' + prefix, 0, end)
+    if found >= 0:
+        return found + 1
+    return 0 if data[:len(prefix)] == prefix and end >= len(prefix) else -1
+
+
+def _add_layer(data, move, offsets, heights, starts):
+    offset, z = move
+    offsets.append(offset)
+    heights.append(z)
+    for values, pattern in zip(starts, (_LAST_X, _LAST_Y, _LAST_E)):
+        values.append(_last_value(pattern, data, offset))
+    return z
+
+
+def build_index(path):
+    offsets, heights = array('d'), array('d')
+    starts = (array('d'), array('d'), array('d')) # X, Y, E
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if not size:
+            return LayerIndex(path, 0, offsets, heights)
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            current = None # height of the last layer
+            z = 0.0
+            relative = False # G91, like gcode.GCodeState
+            pending = None # offset & Z of the last Z move, a new layer if it extrudes before the next one
+            for move in _Z_MOVE.finditer(data):
+                if move.group(2) is not None:
+                    relative = move.group(2) == b'G91'
+                    continue
+                if pending is not None and pending[1] != current and _EXTRUSION.search(data, pending[0], move.start()):
+                    current = _add_layer(data, pending, offsets, heights, starts)
+                try:
+                    z = round(z + float(move.group(1)), 4) if relative else float(move.group(1)) # no float drift
+                except ValueError:
+                    pass
+                pending = (move.start(), z)
+            if pending is not None and pending[1] != current and _EXTRUSION.search(data, pending[0], size):
+                _add_layer(data, pending, offsets, heights, starts)
+            first = int(offsets[0]) if offsets else size
+            relative_e = _last_line(data, b'M83', first) > _last_line(data, b'M82', first)
+        finally:
+            data.close()
+    return LayerIndex(path, size, offsets, heights, relative_e, starts)
+
+
+def index_path(path, cache_dir=PREVIEW_CACHE_DIR):
+    # the cached index is bound to the path, size & date of the file
+    st = os.stat(path)
+    key = '%s:%d:%r'%(os.path.abspath(path), st.st_size, st.st_mtime)
+    return os.path.join(cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.idx')
+
+
+def load_index(path, cache_dir=PREVIEW_CACHE_DIR):
+    # Returns the LayerIndex of a file, built on the first call & cached on disk.
+    # File format: array('d') of INDEX_VERSION, size, relative E, layer count, offsets, heights,
+    # start X, start Y, start E
+    cached = index_path(path, cache_dir)
+    try:
+        with open(cached, 'rb') as f:
+            head = array('d')
+            head.fromfile(f, 4)
+            if head[0] == INDEX_VERSION:
+                count = int(head[3])
+                arrays = [array('d') for _ in range(5)]
+                for values in arrays:
+                    values.fromfile(f, count)
+                return LayerIndex(path, int(head[1]), arrays[0], arrays[1], bool(head[2]), tuple(arrays[2:]))
+    except (IOError, OSError, EOFError):
+        pass
+
+    index = build_index(path)
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        with open(cached + '.tmp', 'wb') as f:
+            array('d', [INDEX_VERSION, index.size, index.relative_e, len(index)]).tofile(f)
+            for values in (index.offsets, index.heights) + tuple(index.starts):
+                values.tofile(f)
+        os.rename(cached + '.tmp', cached)
+    except (IOError, OSError) as e:
+        print("Can't save the layer index of %s: %s"%(path, e))
+    return index
+
+
+def download_path(entry, cache_dir=PREVIEW_CACHE_DIR):
+    # Local copy of a library file (files.FileEntry), named after its date too:
+    # a file sliced again is another download
+    name = '%s_%d_%s'%(entry.origin, int(entry.date or 0), entry.path.replace('/', '_'))
+    return os.path.join(cache_dir, 'downloads', name)
+
+
+def use_download(path):
+    # marks a download as just used for evict_downloads() (explicitly: SD cards are often mounted noatime)
+    os.utime(path, (time.time(), os.path.getmtime(path)))
+
+
+def evict_downloads(keep, budget=DOWNLOADS_BUDGET, cache_dir=PREVIEW_CACHE_DIR):
+    # Removes the least recently used downloads, & their layer index, until they fit in
+    # `budget` bytes. `keep` (the one being shown) stays whatever its size.
+    folder = os.path.join(cache_dir, 'downloads')
+    files, total = [], 0
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        st = os.stat(path)
+        total += st.st_size
+        if path != keep and not name.endswith('.part'): # .part: being downloaded
+            files.append((st.st_atime, st.st_size, path))
+    for atime, size, path in sorted(files):
+        if total <= budget:
+            break
+        try:
+            cached = index_path(path, cache_dir)
+            os.remove(path)
+            if os.path.exists(cached):
+                os.remove(cached)
+            total -= size
+        except OSError as e:
+            print("Can't remove the download %s: %s"%(path, e))
+
+
+def layer_paths(index, layer):
+    # Extrusion polylines of a layer, in mm: list of [(x, y), ...]
+    paths = []
+    points = None
+    x, y, last_e = index.start(layer) # where the previous layer left the toolhead
+    relative = False
+    relative_e = index.relative_e
+    for match in _COMMAND.finditer(index.read(layer)):
+        code = match.group(1)
+        if code == b'G90':
+            relative = relative_e = False
+        elif code == b'G91':
+            relative = relative_e = True
+        elif code == b'M82':
+            relative_e = False
+        elif code == b'M83':
+            relative_e = True
+        elif code == b'G92':
+            words = dict(_WORD.findall(match.group(2)))
+            if b'E' in words:
+                last_e = float(words[b'E'])
+        else: # move
+            words = dict(_WORD.findall(match.group(2)))
+            try:
+                nx = float(words[b'X']) if b'X' in words else None
+                ny = float(words[b'Y']) if b'Y' in words else None
+                e = float(words[b'E']) if b'E' in words else None
+            except ValueError:
+                continue
+            if relative:
+                nx = (x or 0) + nx if nx is not None else x
+                ny = (y or 0) + ny if ny is not None else y
+            else:
+                nx = x if nx is None else nx
+                ny = y if ny is None else ny
+            extruding = False
+            if e is not None:
+                if relative_e:
+                    extruding = e > 0
+                else:
+                    extruding = last_e is not None and e > last_e
+                    last_e = e
+            if extruding and x is not None and y is not None and (nx, ny) != (x, y):
+                if points is None:
+                    points = [(x, y)]
+                    paths.append(points)
+                points.append((nx, ny))
+            elif (nx, ny) != (x, y):
+                points = None
+            x, y = nx, ny
+    return paths
+
+
+def render_layer(index, layer, size, bed_size=PREVIEW_BED_SIZE, colors=PREVIEW_COLORS):
+    # Surface of the given size showing the extrusions of a layer, seen from above
+    surface = pygame.Surface(size)
+    surface.fill(colors['background'])
+    scale = min(size[0] / float(bed_size[0]), size[1] / float(bed_size[1]))
+    bottom = size[1] - 1
+    pygame.draw.rect(surface, colors['travel'], (0, bottom - int(bed_size[1]*scale), int(bed_size[0]*scale), int(bed_size[1]*scale)), 1)
+    for points in layer_paths(index, layer):
+        pygame.draw.lines(surface, colors['extrusion'], False, [(int(px*scale), bottom - int(py*scale)) for px, py in points])
+    return surface
@@ -1,11 +1,65 @@
+import os
+import time
+import heapq
+import itertools
+import threading
+from collections import namedtuple
+
 import requests
-# TODO: find a way to get the x,y,z position of the printer
+from requests.adapters import HTTPAdapter
+
+from perf import counters, tracer, clock
+from observable import Observable
+from gcode import GCodeState
+from history import TemperatureHistory
+from files import FileList, cache_path
+from polling import PollScheduler, POLL_PARTS
 
 BABY_STEPS_DELTA = 0.05 # in mm (firmware defaults)
 MOVE_DELTA = 5 # in mm (firmware defaults)
 
+# (connect, read) timeouts in seconds, per OctoPrint endpoint
+HTTP_TIMEOUTS = {
+        'api/printer': (2.0, 3.0),
+        'api/printer/command': (2.0, 5.0),
+        'api/job': (2.0, 5.0),
+        'api/connection': (2.0, 15.0),
+        'api/files': (2.0, 20.0), # large libraries take a while to list
+        }
+HTTP_DEFAULT_TIMEOUT = (2.0, 10.0)
+HTTP_POOL_SIZE = 4 # max number of kept-alive connections to OctoPrint
+DOWNLOAD_CHUNK_SIZE = 256*1024 # bytes written at once when downloading a file
+POSITION_SYNC_INTERVAL = 30.0 # seconds between two M114 position checks (needs the push channel for the reply)
+
+# Command priority classes, lower runs first
+PRIO_EMERGENCY = 0 # bypasses the queue entirely (M112, cancel)
+PRIO_JOB = 1 # job control & connection
+PRIO_SETPOINT = 2 # temperatures, fan, speed, settings
+PRIO_JOG = 3 # moves, dropped when stale
+PRIO_BROWSE = 4 # file listing
+DISPATCH_MAX_DEPTH = 16 # max number of pending commands
+DISPATCH_MAX_AGE = 1.0 # seconds after which a pending jog is dropped
+
+# Immutable status snapshot, published by fetch_status() in a single assignment
+# so that the renderer can read it from another thread without locking
+PrinterStatus = namedtuple('PrinterStatus', 'offline paused printing status_text temperatures')
+
+NO_TEMPERATURES = {
+        'extruder': (0, 0),
+        'bed': (0, 0),
+        }
+
 
 class PrintCommands: # controller
+    # attributes read by the theme widgets: changes are tracked (see observable.py)
+    paused = Observable(False)
+    printing = Observable(False)
+    offline = Observable(True)
+    status_text = Observable('Unknown')
+    temperatures = Observable(NO_TEMPERATURES)
+    volumetric_enabled = Observable(True)
+    cold_extrude_checks = Observable(True)
+
     def __init__(self, prefix, api_key, port, baudrate):
         self.port = port
         self.baudrate = baudrate
@@ -20,63 +74,227 @@ class PrintCommands: # controller
         self.position_y = RangedValue('Y', 0, 500)
         self.position_z = RangedValue('Z', 0, 500)
         self.position_e = UnrangedValue('E')
+        self.gcode = GCodeState() # follows every command sent, see _emit()
+        self._gcode_lock = threading.Lock()
+        self._position_revision = None # gcode.revision when M114 was sent
+        self._pending_jog = {} # axis: delta of the jogs not sent yet, see _move()
         self.cold_extrude_checks = True
         self.volumetric_enabled = True
         self.filament_diameter = 1.75
 
         self.paused = False
         self.printing = False
+        self.offline = True
         self.status_text = 'Unknown'
+        self.temperatures = NO_TEMPERATURES
+        self.history = TemperatureHistory()
+        self.files = FileList(cache_path(prefix))
+        self.status = PrinterStatus(True, False, False, 'Unknown', NO_TEMPERATURES)
+
+        self.step_scale = 1 # multiplier of the jog & setpoint steps (long press acceleration)
 
         self.req_opts = dict(headers={'X-Api-Key': api_key})
-        self.http = requests # XXX: hack to easily disable http command
+        self.http = HttpTransport(prefix) # XXX: hack to easily disable http command
+        self.emergency_http = HttpTransport(prefix, pool_size=1) # sessions aren't thread safe: emergencies get their own
+        self.engine = None # when set (IOEngine), HTTP requests are run in the background
+        self.transport_lock = threading.Lock() # held by the thread using self.http: its IOEngine worker or a farm poll
+
+    def close(self):
+        for http in (self.http, self.emergency_http):
+            if isinstance(http, HttpTransport):
+                http.close()
+
+    def _request(self, name, fn, *args, **kw):
+        # Runs the HTTP call "fn" inline, or hands it over to the I/O engine if any
+        if self.engine:
+            self.engine.submit(name, fn, *args, **kw)
+        else:
+            kw.pop('priority', None)
+            return fn(*args, **kw)
 
-    def job(self, **params):
+    def _post_job(self, params, http=None):
+        d = (http or self.http).post(self.base_url + 'api/job', json=params, **self.req_opts)
+        if d.status_code != 204:
+            raise RuntimeError(d.text)
+
+    def job(self, priority=PRIO_JOB, **params):
+        if self.engine:
+            return self._request('job', self._post_job, params, priority=priority)
         try:
-            d = self.http.post(self.base_url + 'api/job', json=params, **self.req_opts)
+            self._post_job(params)
         except Exception as e:
             print("Err:", e)
-        else:
-            if d.status_code != 204:
-                print(d.text)
 
-    def fetch_status(self):
+    def fetch_status(self, parts=POLL_PARTS):
+        # parts: POLL_PARTS to fetch, the others are excluded from the reply & kept as they were
+        exclude = ['sd'] + [part for part in POLL_PARTS if part not in parts]
         try:
-            d = self.http.get(self.base_url + 'api/printer', **self.req_opts).json()
-            self.paused = d['state']['flags']['paused']
-            self.printing = d['state']['flags']['printing']
-            self.status_text = d['state']['text']
-            self.temperatures = {
+            d = self.http.get(self.base_url + 'api/printer', params={'exclude': ','.join(exclude), 'history': 'false'},
+                    **self.req_opts).json()
+            status = self.status._replace(offline=False)
+            if 'state' in parts:
+                status = status._replace(
+                    paused = d['state']['flags']['paused'],
+                    printing = d['state']['flags']['printing'],
+                    status_text = d['state']['text'])
+            if 'temperature' in parts:
+                status = status._replace(temperatures = {
                     'extruder': (d['temperature']['tool0']['actual'], d['temperature']['tool0']['target']),
                     'bed': (d['temperature']['bed']['actual'], d['temperature']['bed']['target']),
-                    }
+                    })
         except Exception as e:
-            self.offline = True
-            self.temperatures = {
-                    'extruder': (0, 0),
-                    'bed': (0, 0),
-                    }
+            status = self.status._replace(offline=True, temperatures=NO_TEMPERATURES)
         else:
-            self.offline = False
-            self.e_temp.value = int(d['temperature']['tool0']['target']+0.5)
-            self.bed_temp.value = int(d['temperature']['bed']['target']+0.5)
+            if 'temperature' in parts:
+                self.e_temp.value = int(d['temperature']['tool0']['target']+0.5)
+                self.bed_temp.value = int(d['temperature']['bed']['target']+0.5)
+                self.history.append(time.time(), status.temperatures)
 
+        self.publish_status(status)
         return self.temperatures
 
+    def publish_status(self, status):
+        self.status = status # single assignment: readers always see a consistent snapshot
+        self.offline = status.offline
+        self.paused = status.paused
+        self.printing = status.printing
+        self.status_text = status.status_text
+        self.temperatures = status.temperatures
+
+    def _post_connect(self, d):
+        return self.http.post(self.base_url + 'api/connection', json=d, **self.req_opts)
+
     def connect(self):
         d = dict(port=self.port, baudrate=self.baudrate, autoconnect=True, command='connect')
+        if self.engine:
+            return self._request('connect', self._post_connect, d, priority=PRIO_JOB)
         try:
-            r = self.http.post(self.base_url + 'api/connection', json=d, **self.req_opts)
+            self._post_connect(d)
         except Exception as e:
             print(e)
 
-    def printer_command(self, command):
+    def _get_files(self):
+        headers = dict(self.req_opts['headers'], **self.files.headers())
+        r = self.http.get(self.base_url + 'api/files', params={'recursive': 'true'}, headers=headers)
+        return self.files.update(r)
+
+    def fetch_files(self):
+        # Refreshes the local copy of the file listing, conditional request (see files.py)
+        if self.engine:
+            return self._request('files', self._get_files, priority=PRIO_BROWSE)
+        try:
+            return self._get_files()
+        except Exception as e:
+            print("Can't list the files: %s"%e)
+
+    def download_file(self, entry, dest):
+        # Streams a file of the library to `dest` (blocking: call it from a worker thread).
+        # Sessions aren't thread safe & a download would hold the I/O thread for long:
+        # it gets a connection of its own
+        url = '%sdownloads/files/%s/%s'%(self.base_url, entry.origin, requests.utils.quote(entry.path))
+        http = HttpTransport(self.base_url, pool_size=1) if isinstance(self.http, HttpTransport) else self.http
+        try:
+            r = http.get(url, stream=True, **self.req_opts)
+            try:
+                if r.status_code != 200:
+                    raise RuntimeError('download of %s failed (%d)'%(entry.path, r.status_code))
+                with open(dest + '.part', 'wb') as f:
+                    for chunk in r.iter_content(DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+                os.rename(dest + '.part', dest)
+            finally:
+                r.close()
+        finally:
+            if http is not self.http:
+                http.close()
+        return dest
+
+    def _post_select(self, entry):
+        url = '%sapi/files/%s/%s'%(self.base_url, entry.origin, requests.utils.quote(entry.path))
+        r = self.http.post(url, json=dict(command='select', print=True), **self.req_opts)
+        if r.status_code != 204:
+            raise RuntimeError(r.text)
+
+    def print_file(self, entry):
+        # entry: files.FileEntry
+        if self.engine:
+            return self._request('print_file', self._post_select, entry, priority=PRIO_JOB)
+        try:
+            self._post_select(entry)
+        except Exception as e:
+            print("Err:", e)
+
+    def _post_command(self, js, http=None):
+        r = (http or self.http).post(self.base_url + 'api/printer/command', json=js, **self.req_opts)
+        if r.status_code < 400: # the commands went out (from the I/O thread when there is an engine)
+            self._emit(js.get('commands') or [js['command']])
+        return r.text
+
+    def _post_built(self, build, value):
+        commands = build(value)
+        if commands:
+            return self._post_command({'commands': commands})
+
+    def _emit(self, commands):
+        # Every command sent goes through the local interpreter, which gives the positions shown:
+        # dropped & merged requests are accounted for as they were actually sent
+        with self._gcode_lock:
+            revision = self.gcode.revision
+            self.gcode.feed(commands)
+            if self.gcode.revision != revision:
+                self._sync_position()
+            if any(c.split(';', 1)[0].strip().upper() == 'M114' for c in commands):
+                self._position_revision = self.gcode.revision
+
+    def _sync_position(self):
+        self.position_x.value = self.gcode.position('X')
+        self.position_y.value = self.gcode.position('Y')
+        self.position_z.value = self.gcode.position('Z')
+        self.position_e.value = self.gcode.position('E')
+        self.baby_offset.value = self.gcode.babystep
+
+    def request_position(self):
+        # Asks for the actual position (M114), the reply comes through the push channel logs
+        self.printer_command('M114', priority=PRIO_JOG) # queued after the pending moves
+
+    def on_position(self, position):
+        # (X, Y, Z, E) reported by the printer: ignored if a move was sent after M114,
+        # the reply doesn't account for it
+        with self._gcode_lock:
+            if self._position_revision is not None and self._position_revision == self.gcode.revision:
+                self.gcode.reconcile(*position)
+                self._sync_position()
+            self._position_revision = None
+
+    def coalesced_command(self, key, value, merge, build, priority=PRIO_SETPOINT, post=None):
+        # Sends the G-code returned by build(value); while it is still waiting in the queue,
+        # the next command with the same key is folded into it: value = merge(old, new)
+        post = post or self._post_built
+        with tracer.span('printer_command', key=key, value=value):
+            if self.engine:
+                self.engine.submit(key, post, build, value, priority=priority, coalesce=(key, merge))
+            else:
+                return post(build, value)
+
+    def _post_jog(self, build, deltas):
+        try:
+            return self._post_built(build, deltas)
+        finally: # in the position now (or failed): no longer pending
+            self.jog_settled(deltas)
+
+    def jog_settled(self, deltas):
+        # the jog `deltas` were sent or dropped
+        with self._gcode_lock:
+            for axis, delta in deltas.items():
+                self._pending_jog[axis] = self._pending_jog.get(axis, 0) - delta
+
+    def printer_command(self, command, priority=PRIO_SETPOINT):
         if isinstance(command, str):
             js = {'command': command}
         else:
             js = {'commands': command}
-        r = self.http.post(self.base_url + 'api/printer/command', json=js, **self.req_opts)
-        return r.text
+        with tracer.span('printer_command', command=command):
+            return self._request('printer_command', self._post_command, js, priority=priority)
 
     def pre_heat(self):
         self.printer_command(['M104 S150', 'M140 S60'])
@@ -92,10 +310,12 @@ class PrintCommands: # controller
         self.cold_extrude_checks = not self.cold_extrude_checks
         self.printer_command(['M302 P%s'%('1' if self.cold_extrude_checks else '0')]) # 0 disable checks
 
-    def set_speed(self, x, y):
-        val = int((x+15)*0.65)
-        self.print_speed.value = val
-        self.printer_command(['M220 S%d'%val])
+    def set_speed(self, value=None):
+        # value comes from the UI through the theme's "set_speed" transformer,
+        # without one the current speed is sent again
+        if value is not None:
+            self.print_speed.value = min(self.print_speed.max, max(self.print_speed.min, int(value)))
+        self.printer_command(['M220 S%d'%self.print_speed.value])
 
     def set_origin(self):
         self.printer_command(['G92 X0 Y0 Z0'])
@@ -105,28 +325,20 @@ class PrintCommands: # controller
 
     def home_z(self):
         self.printer_command(['G28 Z'])
-        self.position_z.value = 0
-        self.baby_offset.value = 0
         self.paused = False
 
     def home_xy(self):
         self.printer_command('G28 X Y')
-        self.position_x.value = 0
-        self.position_y.value = 0
         self.paused = False
 
     def home(self):
         self.printer_command(['G28', 'G1 X0 Y0 Z0'])
-        self.position_x.value = 0
-        self.position_y.value = 0
-        self.position_z.value = 0
-        self.baby_offset.value = 0
         self.paused = False
 
     def halt(self):
         stop_count = getattr(self, '_stop_cnt', 0)
         if stop_count:
-            self.printer_command('M112')
+            self.printer_command('M112', priority=PRIO_EMERGENCY)
         stop_count += 1
         self._stop_cnt = stop_count
 
@@ -134,7 +346,7 @@ class PrintCommands: # controller
         self.job(command="restart")
 
     def cancel_print(self):
-        self.job(command="cancel")
+        self.job(command="cancel", priority=PRIO_EMERGENCY)
 
     def pause(self):
         self.paused = not self.paused
@@ -143,68 +355,76 @@ class PrintCommands: # controller
         else:
             self.job(command="pause", action="resume")
 
-    def _send_cmd(self, code, value, value_override=None, pfx='M'):
-        self.printer_command('%s%d %s%s'%(
-            pfx, code,
-            value.name, value_override if value_override is not None else value.value))
+    def _send_cmd(self, code, value, value_override=None, pfx='M', priority=PRIO_SETPOINT):
+        # Setpoints (absolute values) are coalesced keeping the latest one,
+        # relative values (value_override) add up
+        cmd = '%s%d'%(pfx, code)
+        build = lambda v: ['%s %s%s'%(cmd, value.name, format_number(v))]
+        if value_override is None:
+            self.coalesced_command(cmd, value.value, _latest, build, priority=priority)
+        else:
+            self.coalesced_command(cmd, value_override, _add, build, priority=priority)
 
     def e_temp_up(self):
-        if self.e_temp.increment(5):
+        if self.e_temp.increment(5*self.step_scale):
             self._send_cmd(104, self.e_temp)
 
     def e_temp_down(self):
-        if self.e_temp.decrement(5):
+        if self.e_temp.decrement(5*self.step_scale):
             self._send_cmd(104, self.e_temp)
 
     def bed_temp_up(self):
-        if self.bed_temp.increment(MOVE_DELTA):
+        if self.bed_temp.increment(MOVE_DELTA*self.step_scale):
             self._send_cmd(140, self.bed_temp)
 
     def bed_temp_down(self):
-        if self.bed_temp.decrement(MOVE_DELTA):
+        if self.bed_temp.decrement(MOVE_DELTA*self.step_scale):
             self._send_cmd(140, self.bed_temp)
 
     def fan_up(self):
-        if self.fan_speed.increment(MOVE_DELTA):
+        if self.fan_speed.increment(MOVE_DELTA*self.step_scale):
             self._send_cmd(106, self.fan_speed)
 
     def fan_down(self):
-        if self.fan_speed.decrement(MOVE_DELTA):
+        if self.fan_speed.decrement(MOVE_DELTA*self.step_scale):
             self._send_cmd(106, self.fan_speed)
 
+    def _extrude(self, length):
+        # kept apart from the jogs: merged with an XY move it would print a line
+        self.coalesced_command('extrude', {'E': length}, _add_moves, _relative_move, priority=PRIO_JOG)
+
     def e_up(self):
         # Retract move, doesn't "unprint"
-        self.printer_command([
-            'G91',
-            'G1 E%d'%-MOVE_DELTA,
-            'G90',
-            ])
+        self._extrude(-MOVE_DELTA*self.step_scale)
 
     def e_down(self):
         # extrude
-        self.position_e.increment(MOVE_DELTA)
-        self.printer_command([
-            'G91',
-            'G1 E%d'%MOVE_DELTA,
-            'G90',
-            ])
+        self._extrude(MOVE_DELTA*self.step_scale)
 
+    # baby steps are fine tuning: never accelerated
     def baby_down(self):
-        self.baby_offset.decrement(BABY_STEPS_DELTA)
-        self._send_cmd(290, self.baby_offset, value_override=-BABY_STEPS_DELTA)
+        self._send_cmd(290, self.baby_offset, value_override=-BABY_STEPS_DELTA, priority=PRIO_JOG)
 
     def baby_up(self):
-        self.baby_offset.increment(BABY_STEPS_DELTA)
-        self._send_cmd(290, self.baby_offset, value_override=BABY_STEPS_DELTA)
+        self._send_cmd(290, self.baby_offset, value_override=BABY_STEPS_DELTA, priority=PRIO_JOG)
 
     def _move(self, axis, value):
-        if value < 0:
-            r = axis.decrement(-value)
-        else:
-            r = axis.increment(value)
-        if r:
-            print(self.printer_command('G1 %s%s'%(axis.name, axis.value)))
-        return r
+        # Relative move, so that the pending jogs of all axes merge into a single one,
+        # kept within the range of the axis: axis.value is the position sent so far,
+        # the jogs still waiting count too
+        delta = value*self.step_scale
+        with self._gcode_lock:
+            current = axis.value + self._pending_jog.get(axis.name, 0)
+            if delta > 0:
+                target = min(current + delta, max(axis.max, current))
+            else:
+                target = max(current + delta, min(axis.min, current))
+            if target == current:
+                return False
+            self._pending_jog[axis.name] = self._pending_jog.get(axis.name, 0) + target - current
+        self.coalesced_command('jog', {axis.name: target - current}, _add_moves, _relative_move, priority=PRIO_JOG,
+                post=self._post_jog)
+        return True
 
     def z_down_small(self):
         return self._move(self.position_z, -MOVE_DELTA/10.0)
@@ -234,7 +454,324 @@ class PrintCommands: # controller
         return {'quit'}
 
 
+def format_number(value):
+    if isinstance(value, float):
+        return ('%.3f'%value).rstrip('0').rstrip('.')
+    return str(value)
+
+def _latest(old, new):
+    return new
+
+def _add(old, new):
+    return old + new
+
+def _add_moves(old, new):
+    merged = dict(old)
+    for axis, delta in new.items():
+        merged[axis] = merged.get(axis, 0) + delta
+    return merged
+
+def _relative_move(deltas):
+    words = ['%s%s'%(axis, format_number(deltas[axis])) for axis in sorted(deltas) if deltas[axis]]
+    if words:
+        return ['G91', 'G1 ' + ' '.join(words), 'G90']
+    return []
+
+
+class HttpTransport:
+    # Drop-in replacement for the `requests` module used as PrintCommands.http:
+    # keeps a pool of keep-alive connections and applies a timeout per endpoint
+
+    def __init__(self, base_url, timeouts=None, pool_size=HTTP_POOL_SIZE):
+        self.base_url = base_url
+        self.timeouts = dict(HTTP_TIMEOUTS)
+        if timeouts:
+            self.timeouts.update(timeouts)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def endpoint(self, url):
+        endpoint = url[len(self.base_url):] if url.startswith(self.base_url) else url
+        return endpoint.split('?', 1)[0]
+
+    def timeout_for(self, url):
+        return self.timeouts.get(self.endpoint(url), HTTP_DEFAULT_TIMEOUT)
+
+    def request(self, method, url, **kw):
+        kw.setdefault('timeout', self.timeout_for(url))
+        if not (counters.enabled or tracer.enabled):
+            return self.session.request(method, url, **kw)
+        name = '%s %s'%(method, self.endpoint(url))
+        t0 = clock()
+        ok = False
+        try:
+            with tracer.span(name, cat='http'):
+                r = self.session.request(method, url, **kw)
+            ok = r.status_code < 400
+            return r
+        finally:
+            counters.http(name, clock() - t0, ok)
+
+    def get(self, url, **kw):
+        return self.request('GET', url, **kw)
+
+    def post(self, url, **kw):
+        return self.request('POST', url, **kw)
+
+    def close(self):
+        self.session.close()
+
+
+class RequestDropped(Exception):
+    pass
+
+
+class CommandDispatcher:
+    # Bounded priority queue of pending requests (lower priority value runs first).
+    # Jogs waiting for more than `max_age` seconds are dropped instead of being sent late,
+    # when full the oldest entry of the lowest priority class makes room (or the new one is refused).
+
+    def __init__(self, max_depth=DISPATCH_MAX_DEPTH, max_age=DISPATCH_MAX_AGE, on_drop=None):
+        self.max_depth = max_depth
+        self.max_age = max_age
+        self.on_drop = on_drop # callable(item, reason)
+        self._heap = [] # [priority, sequence, time, item, key] entries
+        self._keyed = {} # key: pending entry
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._woken = False
+
+    def __len__(self):
+        return len(self._heap)
+
+    def _drop(self, entry, reason):
+        if self.on_drop:
+            self.on_drop(entry[3], reason)
+
+    def put(self, priority, item, key=None, merge=None):
+        # A pending entry with the same `key` absorbs the item: its item becomes merge(old, new)
+        with self._cond:
+            if key is not None:
+                entry = self._keyed.get(key)
+                if entry is not None:
+                    entry[2] = time.time()
+                    entry[3] = merge(entry[3], item)
+                    return True
+            if len(self._heap) >= self.max_depth:
+                victim = max(self._heap, key=lambda e: (e[0], -e[1]))
+                if victim[0] < priority: # everything pending is more important
+                    self._drop([priority, next(self._seq), time.time(), item, None], 'queue full')
+                    return False
+                self._remove(victim)
+                heapq.heapify(self._heap)
+                self._drop(victim, 'queue full')
+            entry = [priority, next(self._seq), time.time(), item, key]
+            if key is not None:
+                self._keyed[key] = entry
+            heapq.heappush(self._heap, entry)
+            self._cond.notify()
+        return True
+
+    def _remove(self, entry):
+        self._heap.remove(entry)
+        self._forget(entry)
+
+    def _forget(self, entry):
+        if entry[4] is not None and self._keyed.get(entry[4]) is entry:
+            del self._keyed[entry[4]]
+
+    def flush(self, min_priority, reason='flushed'):
+        # remove every pending entry at or below `min_priority` importance
+        with self._cond:
+            kept = [e for e in self._heap if e[0] < min_priority]
+            dropped = [e for e in self._heap if e[0] >= min_priority]
+            self._heap = kept
+            heapq.heapify(self._heap)
+            for entry in dropped:
+                self._forget(entry)
+        for entry in dropped:
+            self._drop(entry, reason)
+
+    def wake(self):
+        with self._cond:
+            self._woken = True
+            self._cond.notify()
+
+    def get(self, timeout):
+        # Returns the next item or None after `timeout` seconds (or when woken)
+        deadline = time.time() + timeout
+        stale = []
+        with self._cond:
+            try:
+                while True:
+                    while self._heap:
+                        entry = heapq.heappop(self._heap)
+                        self._forget(entry)
+                        if entry[0] == PRIO_JOG and time.time() - entry[2] > self.max_age:
+                            stale.append(entry)
+                        else:
+                            return entry[3]
+                    remaining = deadline - time.time()
+                    if self._woken or remaining <= 0:
+                        return None
+                    self._cond.wait(remaining)
+            finally:
+                self._woken = False
+                for entry in stale:
+                    self._drop(entry, 'stale')
+
+
+class IOEngine: # owns the HTTP traffic
+    # Runs the HTTP requests of a PrintCommands in a worker thread, so the UI never waits on the network.
+    # Status is polled when the PollScheduler says so (around every `polling_interval` seconds)
+    # and published as a PrinterStatus snapshot,
+    # each completed request is reported to `on_result(name, result, error)` from the worker thread.
+    # Requests go through a CommandDispatcher, except emergency ones which are sent right away.
+
+    def __init__(self, printer, polling_interval=2.0, on_result=None):
+        self.printer = printer
+        self.polling_interval = polling_interval
+        self.scheduler = PollScheduler(polling_interval)
+        self.on_result = on_result
+        self.dispatcher = CommandDispatcher(on_drop=self._on_drop)
+        self.push = None # optional PushClient, polling is skipped while it is connected
+        self._next_position_sync = 0
+        self._stopped = None # threading.Event of the last worker started, each one has its own
+        self._poll_requested = False
+        self._thread = None
+        printer.engine = self
+
+    def start(self):
+        # a previous worker may still be finishing a request: the new one waits for it (see _loop)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._loop, args=(self._stopped,), name='octoprint-io')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        # doesn't wait for the worker, see join()
+        if self._stopped:
+            self._stopped.set()
+        self.dispatcher.wake()
+
+    def join(self, timeout=None):
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _item(self, name, fn, args, kw):
+        # the trace context (touch id) of the caller follows the request
+        trace = tracer.current()
+        if trace is not None:
+            tracer.request_submitted(trace)
+        return (name, fn, args, kw, trace, clock())
+
+    def submit(self, name, fn, *args, **kw):
+        priority = kw.pop('priority', PRIO_SETPOINT)
+        coalesce = kw.pop('coalesce', None) # (key, merge) to fold the last argument into a pending request
+        if priority <= PRIO_EMERGENCY:
+            return self.emergency(name, fn, *args, **kw)
+        if coalesce:
+            key, merge = coalesce
+            self.dispatcher.put(priority, self._item(name, fn, args, kw), key, lambda old, new: self._merge(merge, old, new))
+        else:
+            self.dispatcher.put(priority, self._item(name, fn, args, kw))
+
+    def _merge(self, merge, old, new):
+        if old[4] is not None: # the older touch won't get a result of its own
+            tracer.request_done(old[4])
+        args = new[2][:-1] + (merge(old[2][-1], new[2][-1]),)
+        return (new[0], new[1], args) + new[3:]
+
+    def emergency(self, name, fn, *args, **kw):
+        # Bypasses the queue and whatever request is in flight: sent at once from its own thread
+        # & connection (fn takes the transport as `http`), anything still waiting (moves, setpoints)
+        # is discarded
+        self.dispatcher.flush(PRIO_SETPOINT)
+        kw['http'] = self.printer.emergency_http
+        t = threading.Thread(target=self._run, args=self._item(name, fn, args, kw), name='octoprint-emergency')
+        t.daemon = True
+        t.start()
+
+    def poll_now(self):
+        self._poll_requested = True
+        self.dispatcher.wake()
+
+    def set_visible(self, parts):
+        # parts of the status shown by the UI, polled more often than the others
+        self.scheduler.set_visible(parts)
+        self.dispatcher.wake()
+
+    def _notify(self, name, result, error, trace=None):
+        # also called from the main thread (requests dropped by put() or flush()): the trace
+        # context of the caller, maybe a touch in progress, is given back afterwards
+        if self.on_result:
+            previous = tracer.current()
+            tracer.set_current(trace)
+            try:
+                self.on_result(name, result, error)
+            except Exception as e:
+                print("Error in I/O result handler for %s: %s"%(name, e))
+            finally:
+                tracer.set_current(previous)
+
+    def _on_drop(self, item, reason):
+        if item[0] == 'jog': # never sent
+            self.printer.jog_settled(item[2][-1])
+        self._notify(item[0], None, RequestDropped(reason), item[4])
+
+    def _run(self, name, fn, args, kw, trace=None, submitted=None):
+        tracer.set_current(trace)
+        if tracer.enabled and submitted is not None:
+            tracer.complete('queued', 'io', submitted, clock(), touch=trace, request=name)
+        try:
+            with tracer.span(name, cat='io'):
+                result = fn(*args, **kw)
+        except Exception as e:
+            self._notify(name, None, e, trace)
+        else:
+            self._notify(name, result, None, trace)
+
+    def _poll(self, parts):
+        self.printer.fetch_status(parts)
+        self._notify('status', self.printer.status, None)
+
+    def _loop(self, stopped):
+        with self.printer.transport_lock: # once the previous worker (or a farm poll) is done with it
+            self._serve(stopped)
+
+    def _serve(self, stopped):
+        scheduler = self.scheduler
+        while not stopped.is_set():
+            item = self.dispatcher.get(max(0, scheduler.next_poll() - time.time()))
+
+            if stopped.is_set():
+                if item:
+                    self._on_drop(item, 'engine stopped')
+                break
+
+            if item:
+                self._run(*item)
+
+            # M114 would stall the print queue of the printer: not while printing
+            if self.push and self.push.connected and not self.printer.printing and time.time() >= self._next_position_sync:
+                self.printer.request_position()
+                self._next_position_sync = time.time() + POSITION_SYNC_INTERVAL
+
+            parts = POLL_PARTS if self._poll_requested else scheduler.due()
+            if parts:
+                if self._poll_requested or not (self.push and self.push.connected):
+                    self._poll(parts)
+                    scheduler.polled(parts, self.printer.status)
+                else:
+                    scheduler.polled(parts)
+                self._poll_requested = False
+
+
 class UnrangedValue:
+    value = Observable(0)
+
     def __init__(self, name, init=0):
         self.name = name
         self.value = init
@@ -253,6 +790,8 @@ class UnrangedValue:
 
 
 class RangedValue:
+    value = Observable(0)
+
     def __init__(self, name, min, max, init=0):
         self.name = name
         self.min = min
@@ -0,0 +1,159 @@
+import json
+import time
+import random
+import string
+import threading
+
+import requests
+
+from gcode import parse_position
+
+PUSH_RECONNECT_DELAY = 1.0 # seconds before the first reconnection attempt
+PUSH_MAX_RECONNECT_DELAY = 30.0 # backoff limit
+PUSH_READ_TIMEOUT = 60.0 # SockJS sends a heartbeat every 25s, consider the link dead after this
+
+
+def _random_id(size=8):
+    return ''.join(random.choice(string.ascii_lowercase + string.digits) for _ in range(size))
+
+
+def parse_temperatures(temps, previous):
+    # Converts an OctoPrint temperature sample to the PrintCommands.temperatures format,
+    # keeping the previous values for the missing entries
+    result = dict(previous)
+    for key, name in (('tool0', 'extruder'), ('bed', 'bed')):
+        t = temps.get(key)
+        if t and t.get('actual') is not None:
+            result[name] = (t['actual'], t['target'] or 0)
+    return result
+
+
+class PushClient: # status push channel
+    # Follows OctoPrint's SockJS push API (xhr-streaming transport) and updates the status
+    # of a PrintCommands incrementally from the "current" & "history" messages.
+    # While `connected` is False the IOEngine keeps polling api/printer.
+
+    def __init__(self, printer, on_update=None):
+        self.printer = printer
+        self.on_update = on_update # callable(status), called from the push thread
+        self.connected = False
+        self._stopped = None # threading.Event of the last thread started, each one has its own
+        self._lock = threading.Lock() # held by the running thread, the next one waits for it
+        self._thread = None
+        self._response = None
+        self._send_url = None
+        self.session = None
+
+    def start(self):
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._loop, args=(self._stopped,), name='octoprint-push')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        # doesn't wait for the thread, see join()
+        if self._stopped:
+            self._stopped.set()
+        self.connected = False
+        response = self._response
+        if response is not None: # unblocks the stream
+            try:
+                response.close()
+            except Exception:
+                pass
+
+    def join(self, timeout=None):
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _loop(self, stopped):
+        with self._lock:
+            self.session = requests.Session() # its own: the previous thread closed its one
+            try:
+                self._reconnect(stopped)
+            finally:
+                self.connected = False
+                self.session.close()
+
+    def _reconnect(self, stopped):
+        delay = PUSH_RECONNECT_DELAY
+        while not stopped.is_set():
+            try:
+                self._stream(stopped)
+            except Exception as e:
+                if not stopped.is_set():
+                    print("Push channel error: %s"%e)
+            else:
+                delay = PUSH_RECONNECT_DELAY
+            self.connected = False
+            if stopped.wait(delay):
+                break
+            delay = min(PUSH_MAX_RECONNECT_DELAY, delay*2)
+
+    def _login(self):
+        # A passive login with the API key gives the credentials for the socket "auth" message
+        r = self.session.post(self.printer.base_url + 'api/login', json={'passive': True},
+                timeout=(2.0, 5.0), **self.printer.req_opts)
+        r.raise_for_status()
+        d = r.json()
+        return '%s:%s'%(d['name'], d['session'])
+
+    def send(self, message):
+        self.session.post(self._send_url, data=json.dumps([json.dumps(message)]),
+                headers={'Content-Type': 'text/plain'}, timeout=(2.0, 5.0))
+
+    def _stream(self, stopped):
+        auth = self._login()
+        url = '%ssockjs/%03d/%s/'%(self.printer.base_url, random.randint(0, 999), _random_id())
+        self._send_url = url + 'xhr_send'
+        r = self._response = self.session.post(url + 'xhr_streaming', stream=True, timeout=(2.0, PUSH_READ_TIMEOUT))
+        try:
+            r.raise_for_status()
+            if stopped.is_set(): # stopped while connecting, stop() didn't see the response
+                return
+            for line in r.iter_lines():
+                if stopped.is_set():
+                    break
+                line = line.decode('utf-8') if isinstance(line, bytes) else line
+                if not line or line[0] == 'h': # prelude & heartbeats
+                    continue
+                if line[0] == 'o':
+                    self.send({'auth': auth})
+                    self.connected = True
+                elif line[0] == 'a':
+                    for msg in json.loads(line[1:]):
+                        self.handle_message(json.loads(msg) if isinstance(msg, str) else msg)
+                elif line[0] == 'c':
+                    break
+        finally:
+            self._response = None
+            r.close()
+
+    def handle_message(self, msg):
+        data = msg.get('current') or msg.get('history')
+        if not data:
+            return
+        printer = self.printer
+        status = printer.status
+        state = data.get('state')
+        if state:
+            status = status._replace(
+                    offline = False,
+                    paused = state['flags']['paused'],
+                    printing = state['flags']['printing'],
+                    status_text = state['text'])
+        if data.get('temps'):
+            for sample in data['temps']: # "history" holds the past samples, "current" the new ones
+                printer.history.append(sample.get('time') or time.time(), parse_temperatures(sample, status.temperatures))
+            latest = data['temps'][-1]
+            status = status._replace(offline=False, temperatures=parse_temperatures(latest, status.temperatures))
+            printer.e_temp.value = int(status.temperatures['extruder'][1]+0.5)
+            printer.bed_temp.value = int(status.temperatures['bed'][1]+0.5)
+        for line in data.get('logs') or ():
+            position = parse_position(line)
+            if position:
+                printer.on_position(position)
+        if status is not printer.status:
+            printer.publish_status(status)
+            if self.on_update:
+                self.on_update(status)
@@ -0,0 +1,81 @@
+import unittest
+
+from gcode import GCodeState, parse_words, parse_position
+
+
+class ParseTest(unittest.TestCase):
+
+    def test_words(self):
+        self.assertEqual(parse_words('G1 X10 Y-2.5 ; comment'), ('G1', {'X': 10.0, 'Y': -2.5}))
+        self.assertEqual(parse_words('g01 x1'), ('G1', {'X': 1.0}))
+        self.assertEqual(parse_words('G28 X Y'), ('G28', {'X': None, 'Y': None}))
+        self.assertEqual(parse_words('; only a comment'), (None, {}))
+
+    def test_position(self):
+        self.assertEqual(parse_position('X:10.00 Y:0.00 Z:5.00 E:-1.50 Count X:800 Y:0 Z:2000'), (10.0, 0.0, 5.0, -1.5))
+        self.assertIsNone(parse_position('ok'))
+
+
+class GCodeStateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.state = GCodeState()
+
+    def positions(self):
+        return tuple(self.state.position(axis) for axis in 'XYZE')
+
+    def test_absolute_and_relative_moves(self):
+        self.state.feed(['G1 X10 Y20 Z5', 'G91', 'G1 X-2 Z0.5', 'G90', 'G1 Y1'])
+        self.assertEqual(self.positions(), (8.0, 1.0, 5.5, 0.0))
+
+    def test_relative_extrusion(self):
+        self.state.feed(['M83', 'G1 E2', 'G1 E3', 'M82', 'G1 E1'])
+        self.assertEqual(self.state.position('E'), 1.0)
+        self.state.feed(['M83', 'G1 X5 E2'])
+        self.assertEqual(self.state.position('E'), 3.0)
+        self.assertEqual(self.state.position('X'), 5.0) # absolute XYZ
+
+    def test_set_position(self):
+        self.state.feed(['G1 X10', 'G92 X0', 'G1 X5'])
+        self.assertEqual(self.state.position('X'), 5.0)
+        self.assertEqual(self.state.native['X'], 15.0)
+        self.state.feed('G92')
+        self.assertEqual(self.positions(), (0.0, 0.0, 0.0, 0.0))
+
+    def test_homing(self):
+        self.state.feed(['G1 X10 Y10 Z10', 'G92 X3', 'M290 Z0.1', 'G28 X'])
+        self.assertEqual(self.positions(), (0.0, 10.0, 10.0, 0.0))
+        self.assertEqual(self.state.babystep, 0.1)
+        self.state.feed('G28')
+        self.assertEqual(self.positions(), (0.0, 0.0, 0.0, 0.0))
+        self.assertEqual(self.state.babystep, 0.0)
+        self.assertEqual(self.state.homed, set('XYZ'))
+
+    def test_home_offset(self):
+        self.state.feed(['M206 Z-1.5', 'G28'])
+        self.assertEqual(self.state.position('Z'), -1.5)
+        self.state.feed('G1 Z2')
+        self.assertEqual(self.state.native['Z'], 3.5)
+
+    def test_baby_steps_are_not_coordinates(self):
+        self.state.feed(['M290 Z0.05', 'M290 Z0.05'])
+        self.assertAlmostEqual(self.state.babystep, 0.1)
+        self.assertEqual(self.state.position('Z'), 0.0)
+
+    def test_revision(self):
+        revision = self.state.revision
+        self.state.feed(['G91', 'M83', 'M104 S200'])
+        self.assertEqual(self.state.revision, revision)
+        self.state.feed('G1 X1')
+        self.assertEqual(self.state.revision, revision + 1)
+
+    def test_reconcile(self):
+        self.state.feed(['G92 X10', 'G1 X12'])
+        self.state.reconcile(20, 1, 2, 3)
+        self.assertEqual(self.positions(), (20.0, 1.0, 2.0, 3.0))
+        self.state.feed('G1 X21')
+        self.assertEqual(self.state.position('X'), 21.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
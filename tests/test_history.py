@@ -0,0 +1,69 @@
+import unittest
+
+from history import TemperatureHistory
+
+
+def sample(actual, target=0):
+    return {'extruder': (actual, target), 'bed': (actual / 2.0, target / 2.0)}
+
+
+class TemperatureHistoryTest(unittest.TestCase):
+
+    def test_samples_in_order(self):
+        history = TemperatureHistory(4)
+        for t in range(3):
+            history.append(t, sample(10*t, 200))
+        self.assertEqual(len(history), 3)
+        self.assertEqual(list(history.samples('extruder')), [0, 10, 20])
+        self.assertEqual(list(history.samples('extruder', 'target')), [200, 200, 200])
+        self.assertEqual(list(history.samples('bed')), [0, 5, 10])
+
+    def test_ring_keeps_the_latest(self):
+        history = TemperatureHistory(4)
+        for t in range(10):
+            history.append(t, sample(t))
+        self.assertEqual(len(history), 4)
+        self.assertEqual(list(history.samples('extruder')), [6, 7, 8, 9])
+
+    def test_older_samples_ignored(self):
+        history = TemperatureHistory(4)
+        self.assertTrue(history.append(10, sample(1)))
+        version = history.version
+        self.assertFalse(history.append(10, sample(2)))
+        self.assertFalse(history.append(5, sample(3)))
+        self.assertEqual(list(history.samples('extruder')), [1])
+        self.assertEqual(history.version, version)
+
+    def test_missing_heater(self):
+        history = TemperatureHistory(4)
+        history.append(1, {'extruder': (200, None)})
+        self.assertEqual(list(history.samples('extruder', 'target')), [0])
+        self.assertEqual(list(history.samples('bed')), [0])
+
+    def test_columns_keep_the_peaks(self):
+        history = TemperatureHistory(100)
+        for t in range(100):
+            history.append(t, sample(50 if t == 37 else 20))
+        columns = history.columns('extruder', 10)
+        self.assertEqual(len(columns), 10)
+        self.assertEqual(columns[3], (20, 50))
+        self.assertEqual(columns[0], (20, 20))
+
+    def test_columns_of_a_short_history(self):
+        history = TemperatureHistory(100)
+        for t in range(3):
+            history.append(t, sample(t))
+        self.assertEqual(history.columns('extruder', 10), [(0, 0), (1, 1), (2, 2)])
+
+    def test_clear(self):
+        history = TemperatureHistory(4)
+        history.append(1, sample(1))
+        version = history.version
+        history.clear()
+        self.assertEqual(len(history), 0)
+        self.assertEqual(history.version, version + 1)
+        self.assertTrue(history.append(0, sample(1)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+
+from hitmap import HitMap
+
+HANDLERS = {'home': lambda: 'home', 'move': lambda x, y: (x, y)}
+
+
+class HitMapTest(unittest.TestCase):
+
+    def compile(self, actions):
+        return HitMap(actions, HANDLERS.get, (480, 320))
+
+    def test_find(self):
+        hitmap = self.compile({(10, 10, 50, 50): 'home', (100, 0, 480, 320): 'move'})
+        self.assertEqual(hitmap.find(20, 20).name, 'home')
+        self.assertEqual(hitmap.find(200, 100).name, 'move')
+        self.assertIsNone(hitmap.find(60, 60))
+        self.assertIsNone(hitmap.find(-5, 20))
+        self.assertIsNone(hitmap.find(20, 1000))
+
+    def test_borders_are_outside(self):
+        hitmap = self.compile({(10, 10, 50, 50): 'home'})
+        self.assertIsNone(hitmap.find(10, 20))
+        self.assertIsNone(hitmap.find(50, 20))
+        self.assertEqual(hitmap.find(11, 49).name, 'home')
+
+    def test_first_declared_wins(self):
+        hitmap = self.compile({(0, 0, 100, 100): 'home', (50, 50, 150, 150): 'move'})
+        self.assertEqual(hitmap.find(75, 75).name, 'home')
+        self.assertEqual(hitmap.find(120, 120).name, 'move')
+        self.assertEqual(hitmap.overlaps, [('home', 'move')])
+
+    def test_handler_arguments(self):
+        hitmap = self.compile({(0, 0, 100, 100): 'home', (100, 0, 200, 100): 'move'})
+        self.assertEqual(hitmap.find(50, 50)(50, 50), 'home')
+        self.assertEqual(hitmap.find(150, 50)(150, 50), (150, 50))
+
+    def test_unknown_and_no_op_actions(self):
+        hitmap = self.compile({(0, 0, 100, 100): 'missing', (100, 0, 200, 100): ''})
+        self.assertEqual(hitmap.unknown, ['missing'])
+        self.assertIsNone(hitmap.find(50, 50))
+        action = hitmap.find(150, 50)
+        self.assertIsNone(action.fn) # swallows the click
+
+    def test_bound_method_position(self):
+        class Printer:
+            def set_speed(self, value=None):
+                return value
+        hitmap = HitMap({(0, 0, 100, 100): 'set_speed'}, lambda name: getattr(Printer(), name), (480, 320))
+        self.assertFalse(hitmap.find(50, 50).wants_position)
+        self.assertIsNone(hitmap.find(50, 50)(50, 50))
+
+
+if __name__ == '__main__':
+    unittest.main()
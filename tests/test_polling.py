@@ -0,0 +1,66 @@
+import unittest
+
+from polling import PollScheduler, activity, POLL_PARTS, POLL_HIDDEN_RATE, POLL_OFFLINE_MAX
+from printer import PrinterStatus
+
+IDLE = PrinterStatus(False, False, False, 'Operational', {'extruder': (21.0, 0), 'bed': (21.0, 0)})
+HEATING = IDLE._replace(temperatures={'extruder': (100.0, 200), 'bed': (21.0, 0)})
+PRINTING = IDLE._replace(printing=True, temperatures={'extruder': (199.0, 200), 'bed': (60.0, 60)})
+OFFLINE = IDLE._replace(offline=True)
+
+
+class ActivityTest(unittest.TestCase):
+
+    def test_activity(self):
+        self.assertEqual(activity(IDLE), 'idle')
+        self.assertEqual(activity(HEATING), 'heating')
+        self.assertEqual(activity(PRINTING), 'printing')
+        self.assertEqual(activity(PRINTING._replace(printing=False, paused=True)), 'printing')
+        self.assertEqual(activity(OFFLINE), 'offline')
+
+
+class PollSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = PollScheduler(2.0)
+
+    def test_everything_due_at_first(self):
+        self.assertEqual(self.scheduler.due(now=0), list(POLL_PARTS))
+
+    def test_rates_follow_the_activity(self):
+        self.scheduler.polled(POLL_PARTS, IDLE, now=100)
+        self.assertEqual(self.scheduler.next_poll(), 105)
+        self.scheduler.polled(POLL_PARTS, HEATING, now=100)
+        self.assertEqual(self.scheduler.next_times, {'state': 102, 'temperature': 101})
+        self.assertEqual(self.scheduler.due(now=101), ['temperature'])
+
+    def test_hidden_parts_are_slower(self):
+        self.scheduler.set_visible(['state'])
+        self.scheduler.polled(POLL_PARTS, PRINTING, now=100)
+        self.assertEqual(self.scheduler.next_times, {'state': 102, 'temperature': 100 + 2*POLL_HIDDEN_RATE})
+
+    def test_shown_part_refreshed_soon(self):
+        self.scheduler.set_visible(['state'])
+        self.scheduler.polled(POLL_PARTS, IDLE)
+        self.scheduler.set_visible(POLL_PARTS)
+        self.assertIn('temperature', self.scheduler.due())
+
+    def test_close_parts_fetched_together(self):
+        self.scheduler.polled(POLL_PARTS, PRINTING, now=100)
+        self.scheduler.next_times['temperature'] = 102.4 # within POLL_MERGE of its period
+        self.assertEqual(self.scheduler.due(now=102), list(POLL_PARTS))
+
+    def test_offline_backoff(self):
+        periods = []
+        for i in range(8):
+            self.scheduler.polled(['state'], OFFLINE, now=0)
+            periods.append(self.scheduler.next_poll())
+        self.assertEqual(periods[:4], [2, 4, 8, 16])
+        self.assertEqual(periods[-1], POLL_OFFLINE_MAX)
+        self.assertEqual(self.scheduler.due(now=POLL_OFFLINE_MAX), list(POLL_PARTS)) # a single probe
+        self.scheduler.polled(POLL_PARTS, IDLE, now=0)
+        self.assertEqual(self.scheduler.backoff, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from files import FileEntry
+from preview import build_index, load_index, layer_paths, download_path, use_download, evict_downloads
+
+GCODE = '''M82
+G28
+G1 Z5 F3000
+G1 Z0.2
+G1 X10 Y10
+G1 X20 Y10 E1
+G1 Z0.6 ; hop
+G1 X30 Y30
+G1 Z0.2
+G1 X30 Y20 E2
+G1 Z0.4
+G1 X40 Y20 E3
+G91
+G1 Z0.2
+G90
+G1 X40 Y30 E4
+'''
+
+
+class BuildIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write(self, text):
+        path = os.path.join(self.folder, 'part.gcode')
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def test_layers(self):
+        index = build_index(self.write(GCODE))
+        self.assertEqual(list(index.heights), [0.2, 0.4, 0.6]) # the hop doesn't count
+        self.assertFalse(index.relative_e)
+        self.assertEqual(index.read(1), b'G1 Z0.4\nG1 X40 Y20 E3\nG91\n')
+
+    def test_layers_start_where_the_previous_one_ended(self):
+        index = build_index(self.write(GCODE))
+        self.assertEqual(index.start(0), (None, None, None))
+        self.assertEqual(index.start(1), (30.0, 20.0, 2.0))
+        self.assertEqual(layer_paths(index, 1), [[(30.0, 20.0), (40.0, 20.0)]])
+        self.assertEqual(layer_paths(index, 2), [[(40.0, 20.0), (40.0, 30.0)]])
+
+    def test_relative_extrusion_on_the_first_line(self):
+        index = build_index(self.write('M83\nG1 Z0.2\nG1 X10 Y10 E1\nG1 X20 Y10 E1\n'))
+        self.assertTrue(index.relative_e)
+        self.assertEqual(layer_paths(index, 0), [[(10.0, 10.0), (20.0, 10.0)]])
+        self.assertFalse(build_index(self.write('M83\nM82\nG1 Z0.2\nG1 X1 E1\n')).relative_e)
+
+    def test_empty_file(self):
+        self.assertEqual(len(build_index(self.write(''))), 0)
+        self.assertEqual(len(build_index(self.write('G28\nG1 Z5\n'))), 0)
+
+    def test_cached_index(self):
+        path = self.write(GCODE)
+        cache = os.path.join(self.folder, 'cache')
+        built = load_index(path, cache)
+        self.assertEqual(len(os.listdir(cache)), 1)
+        loaded = load_index(path, cache)
+        self.assertEqual(list(loaded.offsets), list(built.offsets))
+        self.assertEqual(list(loaded.heights), list(built.heights))
+        self.assertEqual(loaded.start(1), built.start(1))
+
+
+class DownloadsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.folder, 'downloads'))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def download(self, name, used):
+        path = os.path.join(self.folder, 'downloads', name)
+        with open(path, 'wb') as f:
+            f.write(b'G1 X1\n'*20)
+        os.utime(path, (used, 1000))
+        return path
+
+    def test_path_follows_the_date(self):
+        entry = FileEntry('part.gcode', 'parts/part.gcode', 'local', 100, 1700000000, None)
+        self.assertTrue(download_path(entry, self.folder).endswith('local_1700000000_parts_part.gcode'))
+        self.assertNotEqual(download_path(entry._replace(date=1700000001), self.folder), download_path(entry, self.folder))
+
+    def test_least_recently_used_evicted(self):
+        paths = [self.download(name, 1000 + i) for i, name in enumerate('abcd')]
+        use_download(paths[0])
+        load_index(paths[1], self.folder)
+        evict_downloads(paths[3], budget=250, cache_dir=self.folder)
+        self.assertEqual(sorted(os.listdir(os.path.join(self.folder, 'downloads'))), ['a', 'd'])
+        self.assertEqual([name for name in os.listdir(self.folder) if name.endswith('.idx')], []) # its index went too
+
+    def test_shown_file_kept(self):
+        path = self.download('a', 1000)
+        evict_downloads(path, budget=1, cache_dir=self.folder)
+        self.assertTrue(os.path.exists(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
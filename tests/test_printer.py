@@ -0,0 +1,205 @@
+import time
+import threading
+import unittest
+
+from printer import PrintCommands, CommandDispatcher, IOEngine, PRIO_EMERGENCY, PRIO_JOB, PRIO_SETPOINT, PRIO_JOG
+from printer import _add_moves, _latest, _relative_move
+
+
+class _Reply:
+    status_code = 204
+    text = ''
+
+
+class _Transport: # records the commands posted
+    def __init__(self):
+        self.commands = []
+
+    def post(self, url, json=None, **kw):
+        self.commands.append(json.get('commands') or [json['command']])
+        return _Reply()
+
+    def close(self):
+        pass
+
+
+class _Printer: # what IOEngine needs of a PrintCommands
+    emergency_http = 'emergency transport'
+    engine = None
+
+
+class DispatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dropped = []
+        self.dispatcher = CommandDispatcher(max_depth=4, max_age=0.05, on_drop=lambda item, reason: self.dropped.append((item, reason)))
+
+    def drain(self):
+        items = []
+        while True:
+            item = self.dispatcher.get(0)
+            if item is None:
+                return items
+            items.append(item)
+
+    def test_priority_order(self):
+        for priority, item in ((PRIO_JOG, 'jog'), (PRIO_JOB, 'job'), (PRIO_SETPOINT, 'setpoint')):
+            self.dispatcher.put(priority, item)
+        self.assertEqual(self.drain(), ['job', 'setpoint', 'jog'])
+
+    def test_fifo_within_a_priority(self):
+        for item in ('a', 'b', 'c'):
+            self.dispatcher.put(PRIO_SETPOINT, item)
+        self.assertEqual(self.drain(), ['a', 'b', 'c'])
+
+    def test_stale_jog_dropped(self):
+        self.dispatcher.put(PRIO_JOG, 'jog')
+        self.dispatcher.put(PRIO_SETPOINT, 'setpoint')
+        time.sleep(0.1)
+        self.assertEqual(self.drain(), ['setpoint'])
+        self.assertEqual(self.dropped, [('jog', 'stale')])
+
+    def test_fresh_jog_sent(self):
+        self.dispatcher.put(PRIO_JOG, 'jog')
+        self.assertEqual(self.drain(), ['jog'])
+        self.assertEqual(self.dropped, [])
+
+    def test_full_queue_drops_least_important(self):
+        for item in ('jog1', 'jog2'):
+            self.dispatcher.put(PRIO_JOG, item)
+        for item in ('set1', 'set2'):
+            self.dispatcher.put(PRIO_SETPOINT, item)
+        self.assertTrue(self.dispatcher.put(PRIO_JOB, 'job'))
+        self.assertEqual(self.dropped, [('jog1', 'queue full')])
+        self.assertEqual(self.drain(), ['job', 'set1', 'set2', 'jog2'])
+
+    def test_full_queue_refuses_less_important(self):
+        for i in range(4):
+            self.dispatcher.put(PRIO_JOB, i)
+        self.assertFalse(self.dispatcher.put(PRIO_JOG, 'jog'))
+        self.assertEqual(self.dropped, [('jog', 'queue full')])
+        self.assertEqual(len(self.dispatcher), 4)
+
+    def test_flush(self):
+        self.dispatcher.put(PRIO_JOB, 'job')
+        self.dispatcher.put(PRIO_SETPOINT, 'setpoint')
+        self.dispatcher.put(PRIO_JOG, 'jog')
+        self.dispatcher.flush(PRIO_SETPOINT)
+        self.assertEqual(sorted(self.dropped), [('jog', 'flushed'), ('setpoint', 'flushed')])
+        self.assertEqual(self.drain(), ['job'])
+
+    def test_get_times_out(self):
+        t = time.time()
+        self.assertIsNone(self.dispatcher.get(0.05))
+        self.assertGreaterEqual(time.time() - t, 0.04)
+
+    def test_wake(self):
+        threading.Timer(0.05, self.dispatcher.wake).start()
+        t = time.time()
+        self.assertIsNone(self.dispatcher.get(5))
+        self.assertLess(time.time() - t, 2)
+
+
+class CoalescingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = IOEngine(_Printer())
+
+    def pending(self):
+        item = self.engine.dispatcher.get(0)
+        return item and (item[0], item[2])
+
+    def test_pending_jogs_merge(self):
+        for deltas in ({'X': 5}, {'Y': -1}, {'X': 5}):
+            self.engine.submit('jog', None, _relative_move, deltas, priority=PRIO_JOG, coalesce=('jog', _add_moves))
+        self.assertEqual(len(self.engine.dispatcher), 1)
+        self.assertEqual(self.pending(), ('jog', (_relative_move, {'X': 10, 'Y': -1})))
+
+    def test_setpoints_keep_the_latest(self):
+        for value in (200, 205, 210):
+            self.engine.submit('M104', None, value, coalesce=('M104', _latest))
+        self.engine.submit('M140', None, 60, coalesce=('M140', _latest))
+        self.assertEqual(self.pending(), ('M104', (210,)))
+        self.assertEqual(self.pending(), ('M140', (60,)))
+
+    def test_no_merge_once_taken(self):
+        self.engine.submit('jog', None, {'X': 5}, priority=PRIO_JOG, coalesce=('jog', _add_moves))
+        self.assertEqual(self.pending(), ('jog', ({'X': 5},))) # being sent
+        self.engine.submit('jog', None, {'X': 5}, priority=PRIO_JOG, coalesce=('jog', _add_moves))
+        self.assertEqual(self.pending(), ('jog', ({'X': 5},)))
+
+    def test_merged_jog_keeps_its_place(self):
+        self.engine.submit('jog', None, {'X': 5}, priority=PRIO_JOG, coalesce=('jog', _add_moves))
+        self.engine.submit('M104', None, 200, coalesce=('M104', _latest))
+        self.engine.submit('jog', None, {'X': 5}, priority=PRIO_JOG, coalesce=('jog', _add_moves))
+        self.assertEqual([self.pending()[0], self.pending()[0]], ['M104', 'jog'])
+
+    def test_relative_move(self):
+        self.assertEqual(_relative_move({'X': 10, 'Y': -0.25, 'Z': 0}), ['G91', 'G1 X10 Y-0.25', 'G90'])
+        self.assertEqual(_relative_move({'X': 0}), [])
+
+
+class EmergencyTest(unittest.TestCase):
+
+    def test_bypasses_the_queue(self):
+        engine = IOEngine(_Printer())
+        engine.submit('move', lambda: None, priority=PRIO_JOG)
+        engine.submit('setpoint', lambda: None, priority=PRIO_SETPOINT)
+        engine.submit('job', lambda: None, priority=PRIO_JOB)
+        sent = threading.Event()
+        calls = []
+        def stop(http=None):
+            calls.append((threading.current_thread().name, http))
+            sent.set()
+        engine.submit('stop', stop, priority=PRIO_EMERGENCY) # the worker isn't even running
+        self.assertTrue(sent.wait(2))
+        self.assertEqual(calls, [('octoprint-emergency', 'emergency transport')])
+        self.assertEqual(engine.dispatcher.get(0)[0], 'job') # only the moves & setpoints are discarded
+        self.assertIsNone(engine.dispatcher.get(0))
+
+
+class JogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.printer = PrintCommands('http://printer/', 'key', '/dev/null', 115200)
+        self.printer.http = _Transport()
+        self.printer.printer_command(['G92 X498 Y0 Z0']) # sent at once: no engine yet
+        self.engine = IOEngine(self.printer)
+
+    def send_pending(self):
+        item = self.engine.dispatcher.get(0)
+        self.engine._run(*item)
+        return self.printer.http.commands[-1]
+
+    def test_position_follows_sent_commands(self):
+        self.printer.x_down()
+        self.assertEqual(self.printer.position_x.value, 498) # not sent yet
+        self.assertEqual(self.send_pending(), ['G91', 'G1 X-5', 'G90'])
+        self.assertEqual(self.printer.position_x.value, 493)
+
+    def test_clamped_with_the_pending_jogs(self):
+        for i in range(3):
+            self.printer.x_up()
+        self.assertEqual(self.send_pending(), ['G91', 'G1 X2', 'G90'])
+        self.assertEqual(self.printer.position_x.value, 500)
+        self.assertFalse(self.printer.x_up())
+
+    def test_clamped_at_the_minimum(self):
+        self.printer.printer_command(['G92 X3'])
+        self.send_pending()
+        for i in range(3):
+            self.printer.x_down()
+        self.assertEqual(self.send_pending(), ['G91', 'G1 X-3', 'G90'])
+        self.assertEqual(self.printer.position_x.value, 0)
+
+    def test_dropped_jog_not_counted(self):
+        self.printer.x_down()
+        self.engine.dispatcher.flush(PRIO_JOG)
+        self.assertEqual(self.printer.position_x.value, 498)
+        self.printer.x_up()
+        self.printer.x_up()
+        self.assertEqual(self.send_pending(), ['G91', 'G1 X2', 'G90'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+from collections import OrderedDict
+
+import pygame
+
+TEXT_CACHE_SIZE = 256 # max number of rendered strings kept around
+ATLAS_GLYPHS = '0123456789.,-+/%: ' # pre-rendered characters of numeric readouts
+
+
+class GlyphAtlas:
+    # Pre-rendered glyphs of a font in a given color, packed in a single surface.
+    # Strings are drawn by blitting one glyph per character, no FreeType work involved.
+    # Characters outside of the atlas are rendered on first use and kept aside.
+
+    def __init__(self, font, color, chars=ATLAS_GLYPHS):
+        self.font = font
+        self.color = color
+        self.glyphs = {} # char: (surface, source rect or None, advance)
+        rendered = [(c, font.render(c, True, color)) for c in chars]
+        width = sum(s.get_width() for c, s in rendered)
+        height = max(s.get_height() for c, s in rendered)
+        self.surface = pygame.Surface((max(1, width), height), pygame.SRCALPHA)
+        x = 0
+        for c, s in rendered:
+            self.surface.blit(s, (x, 0))
+            self.glyphs[c] = (self.surface, pygame.Rect(x, 0, s.get_width(), s.get_height()), self._advance(c, s))
+            x += s.get_width()
+
+    def _advance(self, char, surface):
+        metrics = self.font.metrics(char)
+        if metrics and metrics[0]:
+            return metrics[0][4]
+        return surface.get_width()
+
+    def glyph(self, char):
+        g = self.glyphs.get(char)
+        if g is None:
+            s = self.font.render(char, True, self.color)
+            g = self.glyphs[char] = (s, None, self._advance(char, s))
+        return g
+
+    def size(self, text):
+        # covers the glyphs overhanging their advance too
+        x = right = 0
+        for c in text:
+            surface, area, advance = self.glyph(c)
+            right = max(right, x + (area or surface.get_rect()).w)
+            x += advance
+        return (max(x, right), self.surface.get_height())
+
+    def draw(self, target, text, pos):
+        x, y = pos
+        for c in text:
+            surface, area, advance = self.glyph(c)
+            target.blit(surface, (x, y), area)
+            x += advance
+        return pygame.Rect(pos[0], y, x - pos[0], self.surface.get_height())
+
+
+class TextRenderer:
+    # Renders texts through a LRU cache of surfaces keyed by (string, font size, color).
+    # Strings with digits (the changing numbers) are composed from a GlyphAtlas instead,
+    # so that they don't fill the cache with values that won't show up again.
+
+    def __init__(self, max_entries=TEXT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._cache = OrderedDict()
+        self._atlases = {}
+
+    def clear(self):
+        self._cache.clear()
+        self._atlases.clear()
+
+    def atlas(self, font, size, color):
+        key = (size, color)
+        atlas = self._atlases.get(key)
+        if atlas is None:
+            atlas = self._atlases[key] = GlyphAtlas(font, color)
+        return atlas
+
+    def render(self, font, size, text, color):
+        key = (text, size, color)
+        surface = self._cache.get(key)
+        if surface is None:
+            surface = self._cache[key] = font.render(text, True, color)
+            if len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(key)
+        return surface
+
+    @staticmethod
+    def is_numeric(text):
+        return any(c.isdigit() for c in text)
+
+    def size(self, font, size, text, color):
+        if self.is_numeric(text):
+            return self.atlas(font, size, color).size(text)
+        return self.render(font, size, text, color).get_size()
+
+    def draw(self, target, font, size, text, color, pos):
+        if self.is_numeric(text):
+            return self.atlas(font, size, color).draw(target, text, pos)
+        return target.blit(self.render(font, size, text, color), pos)
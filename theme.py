@@ -0,0 +1,128 @@
+import os
+import importlib.util
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+THEMES_DIR = os.path.join(BASE_DIR, 'themes')
+ASSETS_DIR = os.path.join(BASE_DIR, 'assets')
+
+WIDGET_TYPES = ('rects', 'texts', 'icons', 'graphs')
+
+_loaded = {} # (themes dir, name): Theme
+
+
+class ThemeError(Exception):
+    pass
+
+
+class Theme:
+    # A validated theme layout, as consumed by the App:
+    #  actions: one {(x1, y1, x2, y2): handler name} dict per page
+    #  widgets: one dict per page, holding all the WIDGET_TYPES lists
+    #  options: dict of UI options
+    #  transformers: {action name: transformer} converting the click position to the value
+    #    given to the action handler (see transform.py)
+
+    def __init__(self, name, path, actions, widgets, options, transformers=None):
+        self.name = name
+        self.path = path
+        self.actions = actions
+        self.widgets = widgets
+        self.options = options
+        self.transformers = transformers or {}
+
+    def __repr__(self):
+        return '<Theme %s (%d pages)>'%(self.name, self.page_count)
+
+    @property
+    def page_count(self):
+        return len(self.widgets)
+
+    def resource_path(self, filename):
+        # theme files override the common assets
+        for p in (os.path.join(self.path, filename), os.path.join(ASSETS_DIR, filename)):
+            if os.path.exists(p):
+                return p
+        return filename
+
+    def background_path(self, page):
+        return self.resource_path('screen%d.png'%(page+1))
+
+
+def _import_layout(name, filename):
+    # Imported as a regular module: the bytecode is cached in __pycache__ like any other
+    spec = importlib.util.spec_from_file_location('pgui4o_theme_%s'%name, filename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _check_position(entry, kind, page):
+    if len(entry) != 3 or not callable(entry[2]):
+        raise ThemeError('page %d: %s entries must be (x, y, handler), got %r'%(page, kind, entry))
+
+
+def validate(name, path, actions, widgets, options, transformers=None):
+    if not isinstance(actions, (list, tuple)) or not isinstance(widgets, (list, tuple)):
+        raise ThemeError('"actions" and "widgets" must be lists')
+    if len(actions) != len(widgets):
+        raise ThemeError('%d pages of actions for %d pages of widgets'%(len(actions), len(widgets)))
+
+    normalized = []
+    for page, (page_actions, page_widgets) in enumerate(zip(actions, widgets)):
+        for coords, handler in page_actions.items():
+            if len(coords) != 4 or not isinstance(handler, str):
+                raise ThemeError('page %d: bad action %r: %r'%(page, coords, handler))
+        unknown = set(page_widgets) - set(WIDGET_TYPES)
+        if unknown:
+            raise ThemeError('page %d: unknown widget types %s'%(page, ', '.join(sorted(unknown))))
+        page_widgets = dict((kind, list(page_widgets.get(kind, []))) for kind in WIDGET_TYPES)
+        for entry in page_widgets['texts']:
+            _check_position(entry, 'texts', page)
+        for entry in page_widgets['icons']:
+            _check_position(entry, 'icons', page)
+        for entry in page_widgets['rects']:
+            if not callable(entry):
+                raise ThemeError('page %d: rects entries must be handlers, got %r'%(page, entry))
+        for entry in page_widgets['graphs']:
+            if len(entry) != 2 or len(entry[0]) != 4 or not callable(entry[1]):
+                raise ThemeError('page %d: graphs entries must be ((x, y, w, h), handler), got %r'%(page, entry))
+        normalized.append(page_widgets)
+
+    transformers = dict(transformers or {})
+    for action, transformer in transformers.items():
+        if not (hasattr(transformer, 'to_value') and hasattr(transformer, 'to_ui')):
+            raise ThemeError('transformer of %s must provide to_value() & to_ui()'%action)
+
+    theme = Theme(name, path, list(actions), normalized, dict(options or {}), transformers)
+    for page in range(theme.page_count):
+        if not os.path.exists(theme.background_path(page)):
+            raise ThemeError('page %d: missing background %s'%(page, theme.background_path(page)))
+    return theme
+
+
+def load_theme(name, themes_dir=THEMES_DIR):
+    # Returns the Theme called `name`, loaded once per process
+    key = (themes_dir, name)
+    if key in _loaded:
+        return _loaded[key]
+
+    path = os.path.join(themes_dir, name)
+    filename = os.path.join(path, 'layout.py')
+    if not os.path.exists(filename):
+        raise ThemeError('no theme "%s" in %s'%(name, themes_dir))
+    try:
+        layout = _import_layout(name, filename)
+    except Exception as e:
+        raise ThemeError('%s: %s'%(filename, e))
+
+    for attr in ('actions', 'widgets'):
+        if not hasattr(layout, attr):
+            raise ThemeError('%s: "%s" is not defined'%(filename, attr))
+
+    theme = _loaded[key] = validate(name, path, layout.actions, layout.widgets,
+            getattr(layout, 'options', {}), getattr(layout, 'transformers', {}))
+    return theme
+
+
+def list_themes(themes_dir=THEMES_DIR):
+    return sorted(d for d in os.listdir(themes_dir) if os.path.exists(os.path.join(themes_dir, d, 'layout.py')))
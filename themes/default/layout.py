@@ -1,4 +1,6 @@
-__all__ = ['actions', 'widgets']
+from transform import Linear
+
+__all__ = ['actions', 'widgets', 'transformers']
 
 # for each screen:
 # x,y,x2,y2 : printer_action_name
@@ -14,6 +16,8 @@ actions = [
         (197, 74, 441, 122): 'cold_extrude',
         (273, 157, 434, 203): 'set_origin',
         (287, 227, 434, 276): 'pre_heat',
+        (175, 140, 265, 172): 'ui_file_browser',
+        (105, 10, 230, 56): 'ui_farm_overview',
         },
     {
         (453, 1, 478, 315): 'ui_main_page',
@@ -60,6 +64,7 @@ std_texts = [
 # for each screen:
 # text: x,y,text (handler function)
 # rect: x,y,x2,y2,color (handler function)
+# graph: (x,y,width,height), handler function returning the (series, 'actual' or 'target', color) curves
 
 std_icons = [
         (452 , 261, lambda ui: 'icon_cube' if ui.printer.volumetric_enabled else ''),
@@ -71,6 +76,8 @@ std_icons = [
 widgets = [
     dict(icons=std_icons,
         texts=std_texts+[
+         (185, 155, lambda ui: "FILES"),
+         (110, 22, lambda ui: ui.printer_name),
          (180, 175, lambda ui: "FAN: %.1f%%"%ui.printer.fan_speed.percentage),
          (180, 200, lambda ui: "E: %.1f/%d"%ui.printer_info['extruder']),
          (180, 225, lambda ui: "BED: %.1f/%d"%ui.printer_info['bed']),
@@ -89,7 +96,11 @@ widgets = [
         (167 , 260, lambda ui: "%.1f/%d"%ui.printer_info['bed']),
         (34 , 260, lambda ui: "%.1f/%d"%ui.printer_info['extruder']),
         (321, 260, lambda ui: "%.1f%%"%ui.printer.fan_speed.percentage),
-        ], rects=[]),
+        ], rects=[],
+        graphs=[
+            ((100, 4, 165, 34), lambda ui: [('extruder', 'target', (120, 40, 20)), ('extruder', 'actual', (255, 110, 40))]),
+            ((275, 4, 165, 34), lambda ui: [('bed', 'target', (40, 60, 120)), ('bed', 'actual', (80, 140, 255))]),
+        ]),
     dict(icons=std_icons,
         texts=std_texts+[
         (5 , 147, lambda ui: "%.2f"%ui.printer.baby_offset.value),
@@ -107,10 +118,15 @@ widgets = [
             (280,  288, lambda ui: "B:%.1f/%d"%ui.printer_info['bed']),
             ],
         rects=[
-                lambda ui: ((4, 160, ui.printer.print_speed.value*(1/0.65)-15, 3), (min(255, ui.printer.print_speed.value+100), 200, 215)),
+                lambda ui: ((4, 160, ui.transformers['set_speed'].to_ui(ui.printer.print_speed.value)-4, 3), (min(255, ui.printer.print_speed.value+100), 200, 215)),
             ]),
     ]
 
+# action name: converter from the click position to the value given to the action
+transformers = {
+    'set_speed': Linear((4, 430), (0, 300)), # speed slider, in %
+    }
+
 
 options = dict(
     default_text_color = (240, 250, 250),
@@ -0,0 +1,72 @@
+import time
+from collections import deque
+
+import pygame
+
+TOUCH_SLOP = 8 # pixels, smaller moves are jitter (resistive panels) and don't count
+VELOCITY_WINDOW = 0.1 # seconds of samples used to estimate the release velocity
+FLING_VELOCITY = 500 # pixels per second, faster releases change page whatever the distance
+TOUCH_SAMPLES = 32 # max samples kept
+
+
+def coalesce_motion(events):
+    # Keeps only the last of consecutive MOUSEMOTION events: the UI needs a single
+    # position per frame, whatever the rate of the touchscreen
+    result = []
+    for event in events:
+        if event.type == pygame.MOUSEMOTION and result and result[-1].type == pygame.MOUSEMOTION:
+            result[-1] = event
+        else:
+            result.append(event)
+    return result
+
+
+class TouchTracker:
+    # Follows a touch from press to release: timestamped positions of the last moments
+    # to tell the velocity of the finger when it leaves the screen.
+
+    def __init__(self):
+        self.samples = deque(maxlen=TOUCH_SAMPLES) # (time, x, y)
+        self.start = None
+
+    def press(self, pos, now=None):
+        now = time.time() if now is None else now
+        self.samples.clear()
+        self.samples.append((now, pos[0], pos[1]))
+        self.start = pos
+
+    def move(self, pos, now=None):
+        if self.start is None:
+            return
+        now = time.time() if now is None else now
+        if len(self.samples) == 1 and abs(pos[0] - self.start[0]) < TOUCH_SLOP and abs(pos[1] - self.start[1]) < TOUCH_SLOP:
+            return # still a tap
+        self.samples.append((now, pos[0], pos[1]))
+
+    def velocity(self, now=None):
+        # (vx, vy) in pixels per second: least squares slope over the last VELOCITY_WINDOW seconds
+        now = time.time() if now is None else now
+        recent = [s for s in self.samples if now - s[0] <= VELOCITY_WINDOW]
+        if len(recent) < 2:
+            return (0.0, 0.0)
+        t0 = recent[0][0]
+        ts = [s[0] - t0 for s in recent]
+        mean_t = sum(ts) / len(ts)
+        var = sum((t - mean_t)**2 for t in ts)
+        if not var:
+            return (0.0, 0.0)
+        slopes = []
+        for axis in (1, 2):
+            values = [s[axis] for s in recent]
+            mean_v = sum(values) / len(values)
+            slopes.append(sum((t - mean_t)*(v - mean_v) for t, v in zip(ts, values)) / var)
+        return tuple(slopes)
+
+    def release(self, pos, now=None):
+        # ((dx, dy) moved since the press, (vx, vy) at release)
+        self.move(pos, now)
+        velocity = self.velocity(now)
+        start, self.start = self.start, None
+        if start is None:
+            return (0, 0), (0.0, 0.0)
+        return (pos[0] - start[0], pos[1] - start[1]), velocity
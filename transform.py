@@ -0,0 +1,28 @@
+# Transformers: two-way bridges between UI coordinates and controller values,
+# declared by the theme layouts for the actions taking a value (see `transformers`)
+
+
+class Linear:
+    # Maps the [ui_min, ui_max] coordinates range on `axis` to [value_min, value_max],
+    # rounded to `step` and clamped; to_ui() is the exact reverse mapping
+
+    def __init__(self, ui_range, value_range, axis='x', step=1):
+        self.ui_min, self.ui_max = ui_range
+        self.value_min, self.value_max = value_range
+        self.axis = axis
+        self.step = step
+
+    def __repr__(self):
+        return 'Linear((%s, %s), (%s, %s), %r)'%(self.ui_min, self.ui_max, self.value_min, self.value_max, self.axis)
+
+    def to_value(self, x, y):
+        pos = x if self.axis == 'x' else y
+        ratio = float(pos - self.ui_min) / (self.ui_max - self.ui_min)
+        ratio = min(1.0, max(0.0, ratio))
+        value = self.value_min + ratio * (self.value_max - self.value_min)
+        value = round(value / self.step) * self.step
+        return int(value) if isinstance(self.step, int) else value
+
+    def to_ui(self, value):
+        ratio = float(value - self.value_min) / (self.value_max - self.value_min)
+        return self.ui_min + ratio * (self.ui_max - self.ui_min)